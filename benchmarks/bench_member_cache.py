@@ -0,0 +1,56 @@
+"""Compares memory use and time to ready for the 'full' and 'lean' member cache policies.
+
+Each policy is measured in a fresh process that logs in with the token from
+config.json, waits for on_ready and reports how long that took, the peak
+resident memory and how many members ended up cached.
+
+Run from the repository root: python benchmarks/bench_member_cache.py
+"""
+import asyncio, json, os, resource, subprocess, sys, time
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, base_dir)
+
+def peak_rss_mb():
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+async def measure(policy):
+    import discord
+    from member_cache import bot_options
+
+    with open(os.path.join(base_dir, 'config.json')) as f:
+        config = json.load(f)
+
+    intents = discord.Intents.default()
+    intents.messages = True
+    intents.message_content = True
+    client = discord.Client(**bot_options(policy, intents))
+    started = time.monotonic()
+    result = {}
+
+    @client.event
+    async def on_ready():
+        result['ready'] = time.monotonic() - started
+        result['guilds'] = len(client.guilds)
+        result['members'] = sum(len(guild.members) for guild in client.guilds)
+        result['rss'] = peak_rss_mb()
+        await client.close()
+
+    await client.start(config['token'])
+    return result
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == '--child':
+        print(json.dumps(asyncio.run(measure(sys.argv[2]))))
+        return
+
+    print(f"{'policy':>6} {'ready (s)':>10} {'peak RSS (MB)':>14} {'guilds':>7} {'cached members':>15}")
+    for policy in ('full', 'lean'):
+        output = subprocess.run([sys.executable, __file__, '--child', policy], capture_output=True, text=True, check=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{policy:>6} {result['ready']:>10.2f} {result['rss']:>14.1f} {result['guilds']:>7} {result['members']:>15}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+"""Compares the compiled ping classifier with the old nested keyword loop.
+
+Run from the repository root: python benchmarks/bench_ping_classifier.py
+"""
+import os, random, re, sys, timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ping_classifier import PingClassifier
+
+KEYWORDS = ["shiny hunt pings", "collection pings", "rare ping", "regional ping"]
+
+def nested_loop(content):
+    # The loop on_message used before the classifier, minus the Discord calls
+    lines = content.lower().splitlines()
+    for line in lines:
+        for keyword in KEYWORDS:
+            if keyword in line and "@" in line:
+                return keyword, [int(user_id) for user_id in re.findall(r'<@!?(\d+)>', line)]
+    return None
+
+def make_corpus(count, seed=246):
+    rng = random.Random(seed)
+    chatter = ["gg", "nice catch", "anyone got a spare rare candy?", "@here raid in 5", "lol", "which one was that"]
+    corpus = []
+    for _ in range(count):
+        kind = rng.random()
+        if kind < 0.7:
+            corpus.append(rng.choice(chatter))
+            continue
+        # Helper bot posts: a header, filler lines and a long list of hunters
+        lines = ["**Pikachu**", "Level 23, IV 71.50%"]
+        lines += [f"<@{rng.randrange(10**17, 10**18)}>" for _ in range(rng.randint(0, 40))]
+        if kind < 0.95:
+            keyword = rng.choice(["Shiny hunt pings", "Collection pings", "Rare ping", "Regional ping"])
+            mentions = ' '.join(f"<@!{rng.randrange(10**17, 10**18)}>" for _ in range(rng.randint(1, 60)))
+            lines.insert(rng.randint(0, len(lines)), f"{keyword}: {mentions}")
+        corpus.append('\n'.join(lines))
+    return corpus
+
+def main():
+    corpus = make_corpus(5000)
+    classifier = PingClassifier()
+
+    # Both approaches must agree on messages with a single ping line
+    for content in corpus:
+        old, new = nested_loop(content), classifier.classify(content)
+        assert (old is None) == (new is None), content
+        if old is not None:
+            assert old[1] == new[1], content
+
+    helper_posts = [content for content in corpus if '\n' in content]
+    for label, messages in (("all messages", corpus), ("helper bot posts", helper_posts)):
+        print(f"{label} ({len(messages)}):")
+        for name, func in (("nested loop", nested_loop), ("classifier", classifier.classify)):
+            best = min(timeit.repeat(lambda: [func(content) for content in messages], number=5, repeat=5)) / 5
+            print(f"  {name:>12}: {best * 1000:8.2f} ms ({best / len(messages) * 1e6:.2f} us/message)")
+
+if __name__ == "__main__":
+    main()
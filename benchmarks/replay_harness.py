@@ -0,0 +1,301 @@
+"""Replays message streams through the ChannelManagement cog without connecting to Discord.
+
+The cog runs against fake bot, guild, channel and member objects. Every REST
+call it makes lands in a recorder that sleeps for a configurable latency
+instead of talking to Discord. The stream is either synthetic (helper bot
+pings of every type, Pokétwo spawns and catches, and background chatter) or
+a recording in JSON lines, one message per line:
+
+    {"at": 0.25, "author": "pokename", "channel": 3, "content": "Shiny hunt pings: <@1001>"}
+
+where "at" is seconds from the start, "author" is pokename, poketox,
+p2assistant, poketwo or anything else for a regular member, and a Pokétwo
+message with "spawn": true carries a spawn embed.
+
+Reports messages/sec handled, event loop lag, ping-to-lock latency
+percentiles, REST calls issued and peak memory.
+
+Run from the repository root: python benchmarks/replay_harness.py --messages 20000 --rate 0
+"""
+import argparse, asyncio, itertools, json, os, random, resource, sys, tempfile, time, tracemalloc
+
+base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, base_dir)
+
+POKENAME, POKETOX, P2ASSISTANT, POKETWO, OWNER = 2001, 2002, 2003, 2004, 2005
+AUTHORS = {'pokename': POKENAME, 'poketox': POKETOX, 'p2assistant': P2ASSISTANT, 'poketwo': POKETWO}
+HUNTERS = range(1001, 1051)
+CHATTERS = range(3001, 3201)
+
+PING_TEMPLATES = {
+    'shiny': "**Shiny hunt pings:** <@{hunter}>",
+    'collection': "**Collection pings:** <@{hunter}> <@{other}>",
+    'rare': "**Rare ping:** @here",
+    'regional': "**Regional ping:** @here",
+}
+
+def write_config(directory, args):
+    config = {
+        'token': 'replay',
+        'owner': OWNER,
+        'pokename': POKENAME,
+        'poketox': POKETOX,
+        'p2assistant': P2ASSISTANT,
+        'poketwo_bot_id': POKETWO,
+        'lock_delay': args.lock_delay,
+        'shiny_lock_duration': args.lock_duration,
+        'regional_lock_duration': args.lock_duration,
+        'collection_lock_duration': args.lock_duration,
+        'ping_cooldown': args.cooldown,
+        'settings_path': os.path.join(directory, 'settings.db'),
+        'history_path': os.path.join(directory, 'lock_history.jsonl'),
+        'settings_flush_delay': 0.2,
+    }
+    path = os.path.join(directory, 'config.json')
+    with open(path, 'w') as f:
+        json.dump(config, f)
+    return path
+
+class RestRecorder:
+    """Stands in for Discord's REST API: counts every call and answers after a fixed latency."""
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.calls = {}
+        self.ids = itertools.count(10_000_000)
+
+    async def call(self, method):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+class FakeMember:
+    def __init__(self, user_id, guild):
+        self.id = user_id
+        self.guild = guild
+        self.mention = f"<@{user_id}>"
+
+class FakePermissions:
+    send_messages = True
+
+class FakeEmbed:
+    def __init__(self, title):
+        self.title = title
+
+class FakeMessage:
+    def __init__(self, message_id, channel, author, content='', embeds=(), mentions=()):
+        self.id = message_id
+        self.channel = channel
+        self.guild = channel.guild
+        self.author = author
+        self.content = content
+        self.embeds = list(embeds)
+        self.mentions = list(mentions)
+        self.reference = None
+
+    async def edit(self, **kwargs):
+        await self.channel.rest.call('edit_message')
+        self.content = kwargs.get('content', self.content)
+        return self
+
+class FakeChannel:
+    def __init__(self, channel_id, guild, rest):
+        self.id = channel_id
+        self.name = f"spawn-{channel_id}"
+        self.mention = f"<#{channel_id}>"
+        self.guild = guild
+        self.rest = rest
+        self.overwrites = {}
+
+    def overwrites_for(self, member):
+        import discord
+        allow, deny = self.overwrites.get(member.id, (discord.Permissions.none(), discord.Permissions.none()))
+        return discord.PermissionOverwrite.from_pair(allow, deny)
+
+    def permissions_for(self, member):
+        return FakePermissions
+
+    async def set_permissions(self, member, overwrite=None):
+        await self.rest.call('set_permissions')
+        self.overwrites[member.id] = overwrite.pair()
+
+    async def send(self, content=None, **kwargs):
+        await self.rest.call('send_message')
+        return FakeMessage(next(self.rest.ids), self, self.guild.me, content or '')
+
+    def get_partial_message(self, message_id):
+        return FakeMessage(message_id, self, self.guild.me)
+
+class FakeGuild:
+    def __init__(self, guild_id, rest):
+        self.id = guild_id
+        self.unavailable = False
+        self.name = f"guild-{guild_id}"
+        self.rest = rest
+        self.members = {}
+        self.me = FakeMember(OWNER, self)
+
+    def get_member(self, user_id):
+        return self.members.get(user_id)
+
+    async def fetch_member(self, user_id):
+        await self.rest.call('fetch_member')
+        member = self.members[user_id] = FakeMember(user_id, self)
+        return member
+
+class FakeBot:
+    def __init__(self, guilds, channels):
+        from metrics import Metrics
+        self.loop = asyncio.get_running_loop()
+        self.metrics = Metrics()
+        self.guilds = guilds
+        self.channels = channels
+
+    async def wait_until_ready(self):
+        return
+
+    def get_guild(self, guild_id):
+        return self.guilds.get(guild_id)
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+def synthetic_stream(args, rng):
+    """(at, author, channel index, content, spawn) tuples: spawns, the pings for them, catches and chatter."""
+    interval = 1 / args.rate if args.rate else 0.0
+    for index in range(args.messages):
+        channel = rng.randrange(args.channels)
+        roll = rng.random()
+        if roll < args.ping_share:
+            ping_type = rng.choice(list(PING_TEMPLATES))
+            content = PING_TEMPLATES[ping_type].format(hunter=rng.choice(HUNTERS), other=rng.choice(HUNTERS))
+            yield index * interval, rng.choice(('pokename', 'poketox', 'p2assistant')), channel, content, False
+        elif roll < args.ping_share * 2:
+            yield index * interval, 'poketwo', channel, '', True
+        elif roll < args.ping_share * 2.5:
+            yield index * interval, 'poketwo', channel, f"Congratulations <@{rng.choice(HUNTERS)}>! You caught a Level 12 Pikachu!", False
+        else:
+            yield index * interval, 'member', channel, "anyone got a spare rare candy?", False
+
+def recorded_stream(path):
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                yield entry['at'], entry['author'], entry['channel'], entry.get('content', ''), entry.get('spawn', False)
+
+def percentile_ms(histogram, percent):
+    value = histogram.percentile(percent)
+    return f"{value * 1000:.1f}" if value is not None else "-"
+
+async def run(args):
+    from channel_management import ChannelManagement
+
+    rest = RestRecorder(args.rest_latency / 1000)
+    guilds = {guild_id: FakeGuild(guild_id, rest) for guild_id in range(1, args.guilds + 1)}
+    channels = {}
+    for index in range(args.channels):
+        guild = guilds[index % args.guilds + 1]
+        channel = channels[100_000 + index] = FakeChannel(100_000 + index, guild, rest)
+        guild.members[POKETWO] = FakeMember(POKETWO, guild)
+        for hunter in HUNTERS:
+            guild.members[hunter] = FakeMember(hunter, guild)
+    channel_list = list(channels.values())
+
+    bot = FakeBot(guilds, channels)
+    cog = ChannelManagement(bot)
+    await cog.cog_load()
+
+    rng = random.Random(args.seed)
+    stream = recorded_stream(args.replay) if args.replay else synthetic_stream(args, rng)
+    message_ids = itertools.count(1)
+    tasks = set()
+    lag = []
+
+    async def watch_loop():
+        # How late a 10 ms timer fires shows how busy the loop is
+        while True:
+            expected = time.perf_counter() + 0.01
+            await asyncio.sleep(0.01)
+            lag.append(time.perf_counter() - expected)
+
+    watcher = asyncio.create_task(watch_loop())
+    tracemalloc.start()
+    started = time.perf_counter()
+    handled = 0
+    for at, author, channel_index, content, spawn in stream:
+        delay = started + at - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        channel = channel_list[channel_index % len(channel_list)]
+        author_id = AUTHORS.get(author) or rng.choice(CHATTERS)
+        member = channel.guild.get_member(author_id) or FakeMember(author_id, channel.guild)
+        embeds = [FakeEmbed("A wild pokémon has appeared!")] if spawn else []
+        message = FakeMessage(next(message_ids), channel, member, content, embeds)
+        # discord.py runs each listener call in its own task, so do the same
+        task = asyncio.create_task(cog.on_message(message))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        handled += 1
+        if handled % 500 == 0:
+            await asyncio.sleep(0)  # let handlers run when replaying as fast as possible
+    dispatched = time.perf_counter() - started
+    # Handlers still in a lock countdown finish after the stream ends
+    while tasks:
+        await asyncio.gather(*list(tasks), return_exceptions=True)
+    elapsed = time.perf_counter() - started
+    # Let the auto-unlocks that are already scheduled go through, so they show up in the REST counts
+    scheduler = cog.unlock_scheduler
+    while scheduler.pending or scheduler._batches:
+        await asyncio.sleep(0.05)
+    _, peak_traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    watcher.cancel()
+
+    await cog.cog_unload()
+
+    print(f"{handled} messages over {args.channels} channels in {args.guilds} servers")
+    print(f"dispatched in {dispatched:.2f}s, all handlers done after {elapsed:.2f}s: {handled / elapsed:,.0f} messages/sec handled")
+    if lag:
+        lag.sort()
+        print(f"event loop lag: p50 {lag[len(lag) // 2] * 1000:.1f} ms, p99 {lag[int(len(lag) * 0.99)] * 1000:.1f} ms, max {lag[-1] * 1000:.1f} ms")
+    counts = {name: sum(bot.metrics.counter_values(name).values()) for name in ('turo_pings_total', 'turo_locks_total', 'turo_unlocks_total', 'turo_interrupts_total', 'turo_skips_total')}
+    print("pings {turo_pings_total}, locks {turo_locks_total}, unlocks {turo_unlocks_total}, interrupted {turo_interrupts_total}, skipped {turo_skips_total}".format(**counts))
+    for labels, count in sorted(bot.metrics.counter_values('turo_skips_total').items()):
+        print(f"  skipped ({labels[0][1]}): {count}")
+    for labels, histogram in sorted(bot.metrics.histogram_values('turo_lock_stage_seconds').items()):
+        print(f"  {labels[0][1]:>8}: p50 {percentile_ms(histogram, 50)} ms, p90 {percentile_ms(histogram, 90)} ms, p99 {percentile_ms(histogram, 99)} ms")
+    print(f"REST calls: {sum(rest.calls.values())} " + ", ".join(f"{method} {count}" for method, count in sorted(rest.calls.items())))
+    totals = [cog.history.guild(guild_id) for guild_id in guilds if cog.history.guild(guild_id) is not None]
+    print(f"lock history: {sum(t.locks for t in totals)} locks, {sum(t.caught for t in totals)} caught and {sum(t.cancelled for t in totals)} cancelled countdowns, "
+          f"{sum(t.auto_unlocks for t in totals)} automatic and {sum(t.manual_unlocks for t in totals)} manual unlocks")
+    summary = cog.rest.summary()
+    print(f"REST dispatcher: completed {summary['completed']}, coalesced {summary['coalesced']}, failed {summary['failed']}")
+    print(f"channel states left: {len(cog.channel_states)}, {len(cog.locked_channels)} channel(s) still locked")
+    # ru_maxrss is kilobytes on Linux and bytes on macOS
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    peak_rss = peak_rss / (1024 * 1024) if sys.platform == 'darwin' else peak_rss / 1024
+    print(f"peak memory: {peak_traced / (1024 * 1024):.1f} MB allocated by Python during the replay, {peak_rss:.1f} MB peak RSS")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--replay', help="JSON lines file to replay instead of a synthetic stream")
+    parser.add_argument('--messages', type=int, default=10_000)
+    parser.add_argument('--rate', type=float, default=2000, help="messages per second, 0 replays as fast as possible")
+    parser.add_argument('--channels', type=int, default=200)
+    parser.add_argument('--guilds', type=int, default=20)
+    parser.add_argument('--ping-share', type=float, default=0.05, help="share of messages that are helper bot pings")
+    parser.add_argument('--lock-delay', type=int, default=0, help="seconds")
+    parser.add_argument('--lock-duration', type=int, default=1, help="seconds")
+    parser.add_argument('--cooldown', type=float, default=1.0, help="seconds")
+    parser.add_argument('--rest-latency', type=float, default=20, help="milliseconds per REST call")
+    parser.add_argument('--seed', type=int, default=246)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        # The cog reads its config when it's imported, so point it at a throwaway one first
+        os.environ['TURO_CONFIG'] = write_config(directory, args)
+        asyncio.run(run(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""Drives RestDispatcher against a local stand-in for Discord that answers with 429s.
+
+The server hands out a small per-channel budget and replies 429 with a
+Retry-After header once a channel's budget is spent, the same way Discord
+does per route. Run from the repository root: python benchmarks/rest_dispatch_429.py
+It fails with an AssertionError if a job is lost or fails, or if locks and
+unlocks don't finish ahead of messages.
+"""
+import asyncio, os, random, sys, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from rest_dispatch import RestDispatcher, LOCK, UNLOCK, NOTIFY, PRIORITY_NAMES
+
+BUDGET = 5  # requests per channel per window
+WINDOW = 1.0
+
+class StandInError(Exception):
+    def __init__(self, status, retry_after):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.response = type('Response', (), {'headers': {'Retry-After': str(retry_after)}})()
+
+class StandInServer:
+    def __init__(self):
+        self.windows = {}
+        self.requests = 0
+        self.rejected = 0
+
+    async def handle(self, reader, writer):
+        request_line = (await reader.readline()).decode()
+        while (await reader.readline()) not in (b'\r\n', b''):
+            pass
+        path = request_line.split()[1]
+        channel = path.split('/')[2]
+        now = time.monotonic()
+        started, used = self.windows.get(channel, (now, 0))
+        if now - started >= WINDOW:
+            started, used = now, 0
+        self.requests += 1
+        if used >= BUDGET:
+            self.rejected += 1
+            retry_after = WINDOW - (now - started)
+            writer.write(f"HTTP/1.1 429 Too Many Requests\r\nRetry-After: {retry_after:.3f}\r\nContent-Length: 0\r\n\r\n".encode())
+        else:
+            self.windows[channel] = (started, used + 1)
+            writer.write(b"HTTP/1.1 204 No Content\r\nContent-Length: 0\r\n\r\n")
+        await writer.drain()
+        writer.close()
+
+async def request(port, method, path):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: localhost\r\n\r\n".encode())
+    await writer.drain()
+    status_line = (await reader.readline()).decode()
+    headers = {}
+    while (line := await reader.readline()) not in (b'\r\n', b''):
+        name, _, value = line.decode().partition(':')
+        headers[name.strip()] = value.strip()
+    writer.close()
+    status = int(status_line.split()[1])
+    if status >= 400:
+        raise StandInError(status, headers.get('Retry-After', '1'))
+    return status
+
+async def main(channels=20, operations=400, seed=246):
+    stand_in = StandInServer()
+    server = await asyncio.start_server(stand_in.handle, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+    # Give the dispatcher a looser budget than the server so it has to learn from the 429s
+    dispatcher = RestDispatcher(workers=8, bucket_limits={'permissions': (BUDGET * 2, WINDOW), 'messages': (BUDGET * 2, WINDOW)})
+    dispatcher.start()
+
+    rng = random.Random(seed)
+    finished = {name: [] for name in PRIORITY_NAMES.values()}
+    started = time.monotonic()
+
+    async def one(priority, channel, kind, key):
+        queued = time.monotonic()
+        await dispatcher.submit(priority, (kind, channel), lambda: request(port, 'PUT', f"/channels/{channel}/{kind}"), key)
+        finished[PRIORITY_NAMES[priority]].append(time.monotonic() - queued)
+
+    jobs = []
+    for _ in range(operations):
+        channel = rng.randrange(channels)
+        priority = rng.choice((LOCK, UNLOCK, NOTIFY, NOTIFY))
+        if priority == NOTIFY:
+            jobs.append(one(priority, channel, 'messages', None))
+        else:
+            jobs.append(one(priority, channel, 'permissions', ('overwrite', channel)))
+    await asyncio.gather(*jobs)
+    elapsed = time.monotonic() - started
+
+    await dispatcher.stop()
+    server.close()
+    await server.wait_closed()
+
+    print(f"{operations} operations over {channels} channels in {elapsed:.2f}s")
+    print(f"stand-in saw {stand_in.requests} requests, {stand_in.rejected} answered with 429")
+    summary = dispatcher.summary()
+    print(f"completed {summary['completed']}, coalesced {summary['coalesced']}, retried after 429 {summary['rate_limited']}, failed {summary['failed']}")
+    for name, latencies in finished.items():
+        if latencies:
+            latencies.sort()
+            print(f"  {name:>6}: p50 {latencies[len(latencies) // 2] * 1000:7.1f} ms, p99 {latencies[int(len(latencies) * 0.99)] * 1000:7.1f} ms")
+
+    # The numbers above are only worth reading if the dispatcher did its job
+    assert sum(len(latencies) for latencies in finished.values()) == operations, "some operations never finished"
+    assert summary['failed'] == 0, f"{summary['failed']} operation(s) failed"
+    assert summary['completed'] + summary['coalesced'] == operations, "an operation was neither run nor coalesced"
+    assert stand_in.rejected > 0, "the stand-in never answered with a 429, nothing was tested"
+    assert summary['rate_limited'] == stand_in.rejected, "not every 429 was retried"
+    # Everything is queued at once, so locks and unlocks must be done before most messages get a turn
+    slowest_urgent = max(max(finished['lock']), max(finished['unlock']))
+    notify = sorted(finished['notify'])
+    assert slowest_urgent < notify[len(notify) // 2], f"a lock or unlock took {slowest_urgent * 1000:.1f} ms, longer than half the messages"
+
+if __name__ == "__main__":
+    asyncio.run(main())
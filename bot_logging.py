@@ -0,0 +1,73 @@
+import json, logging, logging.handlers, queue, sys
+
+# Fields passed through extra= that the JSON output keeps
+FIELDS = ('event', 'guild_id', 'channel_id', 'ping_type')
+
+def context(channel, event, **fields):
+    """extra= for a log record about a channel, so JSON output can be filtered by server and channel."""
+    return {'event': event, 'guild_id': channel.guild.id, 'channel_id': channel.id, **fields}
+
+class SamplingFilter(logging.Filter):
+    """Keeps 1 in N records of each noisy event, anything without a rate goes through."""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = dict(rates)
+        self.seen = {}
+
+    def filter(self, record):
+        event = getattr(record, 'event', None)
+        rate = self.rates.get(event)
+        if not rate or rate <= 1:
+            return True
+        seen = self.seen.get(event, 0)
+        self.seen[event] = seen + 1
+        return seen % rate == 0
+
+class RawQueueHandler(logging.handlers.QueueHandler):
+    """Queues records as they are, leaving all the formatting to the listener's thread.
+
+    The stock prepare() formats the message on the calling thread and drops
+    exc_info, so tracebacks would never reach the formatter. Arguments are
+    formatted later, so log values rather than objects that may change.
+    """
+
+    def prepare(self, record):
+        return record
+
+class JSONFormatter(logging.Formatter):
+    """One JSON object per line."""
+
+    def format(self, record):
+        entry = {
+            'time': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+def setup_logging(level='INFO', json_output=False, sample_rates=None, stream=None):
+    """Routes every logger through a queue, so the event loop never waits on stdout.
+
+    Records are filtered and sampled on the loop, then formatted and written
+    by the QueueListener's thread. Returns the listener, stop it on shutdown
+    to flush whatever is still queued.
+    """
+    records = queue.SimpleQueue()
+    handler = RawQueueHandler(records)
+    handler.addFilter(SamplingFilter(sample_rates or {}))
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JSONFormatter() if json_output else logging.Formatter('%(asctime)s %(levelname)s %(name)s: %(message)s'))
+    root = logging.getLogger()
+    root.setLevel(level)
+    root.handlers[:] = [handler]
+    listener = logging.handlers.QueueListener(records, output)
+    listener.start()
+    return listener
@@ -0,0 +1,54 @@
+import asyncio
+
+# How a countdown ended
+CAUGHT = 'caught'
+TIMED_OUT = 'timed out'
+CANCELLED = 'cancelled'
+
+def is_catch_message(content):
+    return "Congratulations" in content and "You caught a Level" in content
+
+class CatchDispatcher:
+    """Countdowns waiting for a Pokétwo catch, looked up by channel ID.
+
+    bot.wait_for runs every pending check against every message the bot sees,
+    here a catch only wakes the countdown for its own channel.
+    """
+
+    def __init__(self):
+        self.waiters = {}  # channel ID -> future resolved by the next catch in that channel
+
+    def __len__(self):
+        return len(self.waiters)
+
+    async def wait_for_catch(self, channel_id, timeout):
+        """Waits up to timeout seconds and returns CAUGHT, TIMED_OUT or CANCELLED."""
+        future = asyncio.get_running_loop().create_future()
+        # A newer countdown in the same channel takes over from the old one
+        self.cancel(channel_id)
+        self.waiters[channel_id] = future
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return TIMED_OUT
+        finally:
+            if self.waiters.get(channel_id) is future:
+                del self.waiters[channel_id]
+
+    def dispatch(self, channel_id):
+        """Wakes the countdown for the channel, if it has one."""
+        return self._resolve(channel_id, CAUGHT)
+
+    def cancel(self, channel_id):
+        return self._resolve(channel_id, CANCELLED)
+
+    def cancel_all(self):
+        for channel_id in list(self.waiters):
+            self.cancel(channel_id)
+
+    def _resolve(self, channel_id, outcome):
+        future = self.waiters.pop(channel_id, None)
+        if future is not None and not future.done():
+            future.set_result(outcome)
+            return True
+        return False
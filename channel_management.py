@@ -1,329 +1,675 @@
-import discord, json, os, time, re
+import discord, os, time
 from discord.ext import commands
 from discord.ui import Button, View
 from discord import app_commands
 import asyncio
+import logging
 from datetime import datetime, timedelta
+from lock_policy import GuildLockPolicy, DISABLED, PING_TYPES
+from settings_store import SettingsStore
+from unlock_scheduler import UnlockScheduler
+from rest_dispatch import RestDispatcher, LOCK, UNLOCK, NOTIFY, BULK
+from latency import GuildLatencies, LockTimings
+from member_cache import MemberCache
+from channel_state import ChannelStates, COUNTING_DOWN, LOCKED, UNLOCKING
+from catch_dispatch import CatchDispatcher, is_catch_message, CAUGHT, CANCELLED
+from ttl_table import TTLTable
+from metrics import Metrics
+from bot_logging import context
+from config_manager import ConfigManager
+from lock_history import LockHistory, AUTO, MANUAL
 
-# Load the configuration file
 base_dir = os.path.dirname(os.path.abspath(__file__))
-config_path = os.path.join(base_dir, 'config.json')
-
-with open(config_path) as f:
-    config = json.load(f)
-
-pokename = config['pokename']
-poketox = config['poketox']
-p2assistant = config['p2assistant']
-tester = config['owner']
-authorized_ids = [pokename, poketox, p2assistant]
-poketwo_bot_id = config['poketwo_bot_id']
-
-# Default timeout durations (will be overridden by server-specific settings)
-default_lock_delay = config['lock_delay']
-default_shiny_lock_duration = config['shiny_lock_duration']
-default_rare_lock_duration = None
-default_regional_lock_duration = config['regional_lock_duration']
-default_collection_lock_duration = config['collection_lock_duration']
-
-class UnlockView(View):
-    def __init__(self, channel, channel_management):
-        super().__init__(timeout=None)
-        self.channel = channel
-        self.channel_management = channel_management  # Store the instance of ChannelManagement
-        
-    @discord.ui.button(label="Unlock", style=discord.ButtonStyle.danger, emoji="🔐")
-    async def unlock_button(self, interaction: discord.Interaction, button: Button):
-        await unlock_channel(self.channel)
-        await interaction.response.send_message(f"The channel has been unlocked by {interaction.user.mention}.")
-        
-        # Remove the channel ID from locked_channels using the instance of ChannelManagement
-        if self.channel.id in self.channel_management.locked_channels:
-            del self.channel_management.locked_channels[self.channel.id]
-        
-        # Update the button to show it has been used
-        button.label = "Unlocked"
-        button.emoji = "🔓"
-        button.style = discord.ButtonStyle.success
-        button.disabled = True
-        await interaction.message.edit(view=self)
-
-async def unlock_channel(channel):
-    # Unlock the channel for the Poketwo bot
-    bot_member = channel.guild.get_member(poketwo_bot_id)
-    if bot_member is None:
-        await channel.send(":warning: Unable to find Pokétwo bot to let it back in, check that the bot is a member of the server! Otherwise, I may be missing some permissions.")
-    else:
-        overwrite = channel.overwrites_for(bot_member)
-        overwrite.send_messages = True
-        overwrite.read_messages = True
-        overwrite.read_message_history = True
-        await channel.set_permissions(bot_member, overwrite=overwrite)
+# TURO_CONFIG points at a different config file, e.g. for the replay benchmark
+config_path = os.environ.get('TURO_CONFIG') or os.path.join(base_dir, 'config.json')
+settings_path = os.path.join(base_dir, 'settings.db')
+history_path = os.path.join(base_dir, 'lock_history.jsonl')
+
+log = logging.getLogger('turo.locks')
+
+# Seconds before retrying a failed automatic unlock, doubling each time up to the cap
+AUTO_UNLOCK_RETRY = 30
+AUTO_UNLOCK_MAX_RETRY = 3600
+
+# Prebuilt overwrite for the fast lock path, it replaces Pokétwo's overwrite instead of editing the current one
+LOCKED_OVERWRITE = discord.PermissionOverwrite(send_messages=False, read_messages=False, read_message_history=False)
+
+def is_locked(overwrite):
+    return overwrite.send_messages is False and overwrite.read_messages is False and overwrite.read_message_history is False
+
+def is_unlocked(overwrite):
+    return overwrite.send_messages is not False and overwrite.read_messages is not False and overwrite.read_message_history is not False
+
+def is_spawn_message(message):
+    # Pokétwo spawns are an embed titled "A wild pokémon has appeared!"
+    return bool(message.embeds) and "wild pokémon has appeared" in (message.embeds[0].title or "").lower()
+
+class UnlockButton(discord.ui.DynamicItem[Button], template=r'turo:unlock:(?P<channel_id>[0-9]+)'):
+    """The Unlock button on lock messages, routed by the channel ID in its custom_id.
+
+    Registered once in setup, so there's no View kept alive per lock and
+    buttons on old lock messages keep working after a restart.
+    """
+
+    def __init__(self, channel_id):
+        super().__init__(Button(label="Unlock", style=discord.ButtonStyle.danger, emoji="🔐", custom_id=f"turo:unlock:{channel_id}"))
+        self.channel_id = channel_id
+
+    @classmethod
+    async def from_custom_id(cls, interaction, item, match):
+        return cls(int(match['channel_id']))
+
+    async def callback(self, interaction):
+        channel_management = interaction.client.get_cog('ChannelManagement')
+        channel = interaction.client.get_channel(self.channel_id)
+        if channel_management is None or channel is None:
+            await interaction.response.send_message("I can't unlock this channel right now, try /unlock instead.", ephemeral=True)
+            return
+        # The unlock may queue behind locks elsewhere, acknowledge the click before Discord's 3 second deadline
+        await interaction.response.defer()
+        # Unlock through the instance of ChannelManagement, which also forgets the lock
+        await channel_management.unlock_channel(channel)
+        channel_management.metrics.inc('turo_unlocks_total', kind='button')
+        await interaction.followup.send(f"The channel has been unlocked by {interaction.user.mention}.")
+
+        # Update the button to show it has been used, a deferred click's original response is the message it was on
+        await interaction.edit_original_response(view=unlocked_view())
+
+def unlock_view(channel_id):
+    # Stopped before it's sent so discord.py doesn't keep it in the view store, UnlockButton handles the clicks
+    view = View(timeout=None)
+    view.add_item(UnlockButton(channel_id))
+    view.stop()
+    return view
+
+def unlocked_view():
+    view = View(timeout=None)
+    view.add_item(Button(label="Unlocked", style=discord.ButtonStyle.success, emoji="🔓", disabled=True))
+    view.stop()
+    return view
+
+class LockRecord:
+    """A locked channel, kept as IDs only so thousands of locks don't pin thousands of Message objects."""
+
+    __slots__ = ('guild_id', 'message_id', 'unlock_time', 'ping_type', 'locked_at', 'retries')
+
+    def __init__(self, guild_id, message_id, unlock_time, ping_type=None, locked_at=None):
+        self.guild_id = guild_id
+        self.message_id = message_id
+        self.unlock_time = unlock_time  # None for a permanent lock
+        self.ping_type = ping_type  # None for manual locks
+        self.locked_at = locked_at  # None when restored after a restart, the lock time isn't saved
+        self.retries = 0  # Failed automatic unlocks in a row
 
 class ChannelManagement(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
-        self.locked_channels = {}
-        self.last_actioned_message = {}  # Dictionary to track last message timestamp for each channel
-
-    def get_server_config(self, guild_id):
-        default_config = {
-            'lock_delay': default_lock_delay,
-            'shiny_lock_duration': default_shiny_lock_duration,
-            'rare_lock_duration': default_rare_lock_duration,
-            'regional_lock_duration': default_regional_lock_duration,
-            'collection_lock_duration': default_collection_lock_duration,
+        # main.py shares its ConfigManager so config.json edits reach the running cog, otherwise the cog watches the file itself
+        self.config_manager = getattr(bot, 'config_manager', None)
+        self.owns_config_manager = self.config_manager is None
+        if self.owns_config_manager:
+            self.config_manager = ConfigManager(config_path)
+        # The current config snapshot, swapped whole by on_config_change so a message never sees half an update
+        self.config = config = self.config_manager.config
+        self.locked_channels = {}  # channel ID -> LockRecord
+        self.unlock_scheduler = UnlockScheduler(self.auto_unlock_channels)  # Single timer for every pending auto-unlock
+        self.channel_states = ChannelStates()  # Where each busy channel is in the lock pipeline
+        # Last Pokétwo spawn message ID in each channel, to tell helper bot pings for the same spawn apart
+        self.spawns = TTLTable(config.get('spawn_ttl', 900), config.get('max_spawns', 100_000))
+        self.catches = CatchDispatcher()  # Lock countdowns waiting to be interrupted by a catch, by channel
+        self.metrics = getattr(bot, 'metrics', None) or Metrics()  # main.py keeps one registry on the bot so counts survive a reload
+        # Every permission change and lock message goes through here, locks first
+        self.rest = RestDispatcher(workers=config.get('rest_workers', 4), reserved_workers=config.get('rest_reserved_workers', 2), bucket_limits=config.get('rest_bucket_limits'), metrics=self.metrics)
+        self.members = MemberCache(config.poketwo_bot_id, config.get('hunter_cache_size', 5000))  # Works with either member cache policy
+        self.latencies = GuildLatencies()  # Ping-to-lock timings for each server
+        # Per-server settings live in settings.db, config.json only holds the token and bot-wide defaults
+        # Several bot processes can point at the same file when the shards are split up
+        self.settings = SettingsStore(config.get('settings_path', settings_path), config.get('server_configs'), config.get('settings_flush_delay', 1.0), config.ping_cooldown)
+        # Every lock, interrupt, cooldown skip and unlock, with running totals for /lock_stats
+        self.history = LockHistory(config.get('history_path', history_path), self.settings, config.get('history_max_bytes', 10 * 1024 * 1024))
+        self.last_actioned_message = self.settings.cooldowns  # Last time a ping was actioned in each channel, shared through settings.db
+        self.policies = {}  # Resolved GuildLockPolicy for each server, dropped whenever its config is saved
+
+    async def cog_load(self):
+        self.rest.start()
+        self.unlock_scheduler.start()
+        self.config_manager.subscribe(self.on_config_change)
+        if self.owns_config_manager:
+            self.config_manager.start()
+        # Pick up locks from before a restart or extension reload once the channel cache is ready
+        self.reconcile_task = self.bot.loop.create_task(self.reconcile_locks())
+        self.settings_task = self.bot.loop.create_task(self.watch_settings())
+
+    async def cog_unload(self):
+        self.reconcile_task.cancel()
+        self.settings_task.cancel()
+        self.config_manager.unsubscribe(self.on_config_change)
+        if self.owns_config_manager:
+            self.config_manager.stop()
+        self.catches.cancel_all()
+        await self.unlock_scheduler.stop()
+        await self.rest.stop()
+        # Make sure queued settings hit the disk before a reload or shutdown, the history saves its totals through them
+        await self.history.close()
+        await self.settings.close()
+
+    def on_config_change(self, new, old):
+        """Swaps in a new config.json without touching locks, countdowns or pending unlocks."""
+        self.config = new
+        if new.defaults != old.defaults:
+            # Every cached policy was resolved against the old defaults
+            self.policies = {}
+        if new.poketwo_bot_id != old.poketwo_bot_id:
+            self.members.poketwo_bot_id = new.poketwo_bot_id
+            self.members.poketwo.clear()
+        self.settings.cooldowns.ttl = new.ping_cooldown
+        log.info("Config reloaded: %d helper bot(s), defaults %s", len(new.authorized_ids), new.defaults)
+
+    async def watch_settings(self):
+        # Other processes sharing settings.db may change a server's settings, pick those up too
+        while True:
+            await asyncio.sleep(self.config.get('settings_poll_interval', 5.0))
+            try:
+                changed = await self.settings.refresh()
+            except Exception:
+                log.exception("Failed to check settings.db for changes")
+                continue
+            for guild_id in changed:
+                self.policies.pop(int(guild_id), None)
+            if changed:
+                log.info("Picked up new settings for %d server(s) from settings.db", len(changed))
+
+    def get_policy(self, guild_id):
+        policy = self.policies.get(guild_id)
+        if policy is None:
+            policy = self.policies[guild_id] = GuildLockPolicy(self.settings.get(guild_id), self.config.defaults)
+        return policy
+
+    def memory_report(self):
+        """How many entries each of the cog's tables is holding, for /debug memory."""
+        return {
+            'locked channels': len(self.locked_channels),
+            'pending unlocks': self.unlock_scheduler.pending,
+            'channel states': len(self.channel_states),
+            'cooldowns': len(self.last_actioned_message),
+            'spawns': len(self.spawns),
+            'catch waiters': len(self.catches),
+            'cached members': len(self.members),
+            'policies': len(self.policies),
+            'latency guilds': len(self.latencies.guilds),
+            'REST queue': self.rest.depth,
+            'REST buckets': len(self.rest._buckets),
         }
-        return {**default_config, **config['server_configs'].get(str(guild_id), {})}
 
     def save_server_config(self, guild_id, config_type, value=None, permanent_lock=False):
-        server_config = config['server_configs'].get(str(guild_id), {})
-        if config_type == 'lock_delay':
+        server_config = dict(self.settings.get(guild_id))
+        if config_type in ('lock_delay', 'fast_lock'):
             server_config[config_type] = value
         else:
             if permanent_lock:
                 server_config[config_type] = {'permanent_lock': True}
             else:
                 server_config[config_type] = {'value': value, 'permanent_lock': False}
-        config['server_configs'][str(guild_id)] = server_config
-        with open(config_path, 'w') as f:
-            json.dump(config, f, indent=4)
+        self.settings.set(guild_id, server_config)
+        self.policies.pop(guild_id, None)
+
+    async def set_locked(self, channel, member, locked, priority, overwrite=None, timings=None):
+        async def apply():
+            if overwrite is not None:
+                await channel.set_permissions(member, overwrite=overwrite)
+                return
+            # Worked out when the request actually goes out, so a queued change always builds on the current overwrite
+            current = channel.overwrites_for(member)
+            current.send_messages = not locked
+            current.read_messages = not locked
+            current.read_message_history = not locked
+            await channel.set_permissions(member, overwrite=current)
+        # Only the latest lock or unlock for a channel matters, an older one still queued is dropped
+        await self.rest.run(priority, ('permissions', channel.id), apply, ('overwrite', channel.id))
+        if timings is not None:
+            timings.mark('locked')
+            self.latencies.record(channel.guild.id, timings)
+            for stage, seconds in timings.stages().items():
+                self.metrics.observe('turo_lock_stage_seconds', seconds, stage=stage)
+
+    async def send(self, channel, content=None, **kwargs):
+        return await self.rest.run(NOTIFY, ('messages', channel.id), lambda: channel.send(content, **kwargs))
+
+    async def edit(self, message, **kwargs):
+        return await self.rest.run(NOTIFY, ('messages', message.channel.id), lambda: message.edit(**kwargs), ('edit', message.id))
     
     @commands.hybrid_command(name="lock", description="Locks the current channel you're in, if unlocked")
     async def lock(self, ctx):
         """Locks the current channel until manually unlocked."""
         await ctx.send("Manually locking channel...", ephemeral=True)  # Initial response to prevent timeout
         await self.lock_channel_immediately(ctx.channel)
-        print(f'{message.guild.name} - {message.channel.name} - channel manually locked')
+        log.info("%s - %s - channel manually locked", ctx.guild.name, ctx.channel.name, extra=context(ctx.channel, 'manual_lock'))
     
-    async def lock_channel(self, channel, lock_duration, lock_delay):
-        # Notify the channel that it will be locked soon with a countdown
-        lock_time = datetime.now() + timedelta(seconds=lock_delay)
-        lock_timestamp = int(lock_time.timestamp())
-        countdown_message = await channel.send(f"The channel will be locked <t:{lock_timestamp}:R>.")
-        
-        # Wait for the lock delay duration
+    async def lock_channel(self, channel, lock_duration, lock_delay, timings=None, fast=False, generation=None, ping_type=None):
+        # The caller moves the channel to counting down before it awaits anything, so duplicate pings see it straight away
+        if generation is None:
+            generation = self.channel_states.transition(channel.id, COUNTING_DOWN)
         try:
-            await self.bot.wait_for(
-                'message', 
-                timeout=lock_delay, 
-                check=lambda m: (
-                    m.channel == channel and 
-                    m.author.id == poketwo_bot_id and 
-                    "Congratulations" in m.content and 
-                    "You caught a Level" in m.content
-                )
-            )
-            await countdown_message.edit(content="Interrupted by a catch, not locking the channel!")
-            print(f"{channel.guild.name} - {channel.name} - Interrupted by a message containing 'Congratulations' and 'You caught a Level', not locking the channel!")
-        except asyncio.TimeoutError:
-            # Lock the channel for the Poketwo bot
-            bot_member = channel.guild.get_member(poketwo_bot_id)
-            
-            if bot_member is None:
-                await channel.send(":warning: Unable to find Pokétwo bot to lock it out, check that the bot is a member of the server! Otherwise, I may be missing some permissions.")
+            # Notify the channel that it will be locked soon with a countdown
+            lock_time = datetime.now() + timedelta(seconds=lock_delay)
+            lock_timestamp = int(lock_time.timestamp())
+            countdown = self.send(channel, f"The channel will be locked <t:{lock_timestamp}:R>.")
+            if fast:
+                # Start the countdown straight away and let the message post alongside it
+                countdown = asyncio.ensure_future(countdown)
             else:
-                overwrite = channel.overwrites_for(bot_member)
-                overwrite.send_messages = False
-                overwrite.read_messages = False
-                overwrite.read_message_history = False
-                await channel.set_permissions(bot_member, overwrite=overwrite)
+                countdown_message = await countdown
+
+            if timings is not None:
+                timings.mark('countdown_started')
+            # Wait for the lock delay duration, on_message wakes us up early if the spawn gets caught
+            outcome = await self.catches.wait_for_catch(channel.id, lock_delay)
+            if fast:
+                countdown_message = await countdown
+            if outcome == CAUGHT:
+                self.channel_states.reset(channel.id, generation)
+                await self.edit(countdown_message, content="Interrupted by a catch, not locking the channel!")
+                self.metrics.inc('turo_interrupts_total', reason='caught')
+                self.history.interrupt(channel, ping_type, 'caught')
+                log.info("%s - %s - Interrupted by a catch, not locking the channel", channel.guild.name, channel.name, extra=context(channel, 'caught'))
+                return
+            if outcome == CANCELLED or not self.channel_states.owns(channel.id, generation):
+                self.channel_states.reset(channel.id, generation)
+                await self.edit(countdown_message, content="Lock countdown cancelled.")
+                self.metrics.inc('turo_interrupts_total', reason='cancelled')
+                self.history.interrupt(channel, ping_type, 'cancelled')
+                log.info("%s - %s - Lock countdown cancelled by another lock action", channel.guild.name, channel.name, extra=context(channel, 'countdown_cancelled'))
+                return
+
+            if timings is not None:
+                timings.mark('delay_expired')
+                self.metrics.observe('turo_lock_delay_seconds', timings.delay_expired - timings.countdown_started)
+            async with self.channel_states.locked(channel.id) as state:
+                # A manual lock or unlock may have taken over while we waited for the lock
+                if not self.channel_states.owns(channel.id, generation):
+                    return
+                # Lock the channel for the Poketwo bot
+                bot_member = await self.members.poketwo_member(channel.guild)
+
+                if bot_member is None:
+                    self.channel_states.reset(channel.id, generation)
+                    await self.send(channel, ":warning: Unable to find Pokétwo bot to lock it out, check that the bot is a member of the server! Otherwise, I may be missing some permissions.")
+                    return
+                lock = self.set_locked(channel, bot_member, True, LOCK, LOCKED_OVERWRITE if fast else None, timings)
 
                 # Create the unlock button view
-                view = UnlockView(channel, self)
+                view = unlock_view(channel.id)
 
                 if lock_duration:
                     unlock_time = datetime.now() + timedelta(seconds=lock_duration)
                     unlock_timestamp = int(unlock_time.timestamp())
-                    await countdown_message.edit(content=f"The channel has been locked, it will unlock at <t:{unlock_timestamp}>.", view=view)
+                    content = f"The channel has been locked, it will unlock at <t:{unlock_timestamp}>."
                 else:
-                    await countdown_message.edit(content=f"The channel has been locked, it will stay locked until someone unlocks manually.", view=view)
+                    content = f"The channel has been locked, it will stay locked until someone unlocks manually."
 
-                self.locked_channels[channel.id] = {
-                    'message': countdown_message,
-                    'unlock_time': unlock_time.timestamp() if lock_duration else None
-                }
+                if fast:
+                    # The lock notice doesn't need to wait for the permission write
+                    await asyncio.gather(lock, self.edit(countdown_message, content=content, view=view))
+                else:
+                    await lock
+                    await self.edit(countdown_message, content=content, view=view)
+                generation = self.channel_states.transition(channel.id, LOCKED, state.spawn_id)
+                self.metrics.inc('turo_locks_total', kind='countdown')
+                self.history.lock(channel, ping_type, 'countdown')
 
-                if lock_duration:
-                    self.bot.loop.create_task(self.auto_unlock_channel(channel, lock_duration))
+                record = self.locked_channels[channel.id] = LockRecord(channel.guild.id, countdown_message.id, unlock_time.timestamp() if lock_duration else None, ping_type, time.time())
+                self.settings.save_lock(channel.id, record.guild_id, record.message_id, record.unlock_time)
 
-    async def lock_channel_immediately(self, channel):
-        bot_member = channel.guild.get_member(poketwo_bot_id)
+                if lock_duration:
+                    self.unlock_scheduler.schedule(channel.id, unlock_time.timestamp())
+                else:
+                    self.unlock_scheduler.cancel(channel.id)
+        except BaseException:
+            # Never leave a channel stuck counting down because Discord said no
+            if self.channel_states.state(channel.id) == COUNTING_DOWN:
+                self.channel_states.reset(channel.id, generation)
+            raise
+
+    async def lock_channel_immediately(self, channel, priority=LOCK):
+        self.catches.cancel(channel.id)
+        bot_member = await self.members.poketwo_member(channel.guild)
         if bot_member is None:
-            await channel.send(":warning: Unable to find Pokétwo bot to lock it out, check that the bot is a member of the server! Otherwise, I may be missing some permissions.")
-        else:
-            overwrite = channel.overwrites_for(bot_member)
-            overwrite.send_messages = False
-            overwrite.read_messages = False
-            overwrite.read_message_history = False
-            await channel.set_permissions(bot_member, overwrite=overwrite)
+            await self.send(channel, ":warning: Unable to find Pokétwo bot to lock it out, check that the bot is a member of the server! Otherwise, I may be missing some permissions.")
+            return
+        async with self.channel_states.locked(channel.id):
+            # Locked from here on, so pings arriving while Discord catches up are treated as duplicates
+            generation = self.channel_states.transition(channel.id, LOCKED)
+            try:
+                await self.set_locked(channel, bot_member, True, priority)
+            except BaseException:
+                self.channel_states.reset(channel.id, generation)
+                raise
+            self.metrics.inc('turo_locks_total', kind='immediate')
+            self.history.lock(channel, None, 'immediate')
 
             # Create the unlock button view
-            view = UnlockView(channel, self)
+            view = unlock_view(channel.id)
 
             # Notify the channel that it has been locked and add the unlock button
-            countdown_message = await channel.send("The channel has been locked.", view=view)
-
-            self.locked_channels[channel.id] = {
-                'message': countdown_message,
-                'unlock_time': None  # Permanent lock
-            }
-
-    async def auto_unlock_channel(self, channel, delay):
-        await asyncio.sleep(delay)
-        if channel.id in self.locked_channels:
-            unlock_time = self.locked_channels[channel.id]['unlock_time']
-            if unlock_time and datetime.now().timestamp() >= unlock_time:
-                await unlock_channel(channel)
-                await channel.send("The channel has been automatically unlocked due to inactivity. The spawn is now free-for-all to catch.")
-                print(f"{channel.guild.name} - {channel.name} - Channel was unlocked due to inactivity.")
-                del self.locked_channels[channel.id]
+            countdown_message = await self.send(channel, "The channel has been locked.", view=view)
+
+            self.locked_channels[channel.id] = LockRecord(channel.guild.id, countdown_message.id, None, locked_at=time.time())  # Permanent lock
+            self.settings.save_lock(channel.id, channel.guild.id, countdown_message.id, None)
+            self.unlock_scheduler.cancel(channel.id)
+
+    def forget_lock(self, channel_id):
+        self.catches.cancel(channel_id)
+        self.locked_channels.pop(channel_id, None)
+        self.settings.delete_lock(channel_id)
+        self.unlock_scheduler.cancel(channel_id)
+
+    async def lock_still_in_place(self, channel):
+        """Checks a channel we think is locked against its real overwrite.
+
+        Someone may have let Pokétwo back in by hand, in which case the lock is
+        forgotten and the channel goes back to idle. Returns False if it did.
+        """
+        state = self.channel_states.channels.get(channel.id)
+        if state is None or state.state != LOCKED or state.users:
+            return True  # Nothing to check, or a transition is still setting the overwrite
+        generation = state.generation
+        bot_member = await self.members.poketwo_member(channel.guild)
+        if bot_member is None or is_locked(channel.overwrites_for(bot_member)):
+            return True
+        if not self.channel_states.owns(channel.id, generation) or state.users:
+            return True  # Something else took the channel over while we looked
+        log.info("%s - %s - Channel was unlocked outside the bot, forgetting the lock", channel.guild.name, channel.name, extra=context(channel, 'stale_lock'))
+        self.forget_lock(channel.id)
+        self.channel_states.reset(channel.id, generation)
+        return False
+
+    async def reconcile_locks(self):
+        await self.bot.wait_until_ready()
+        now = time.time()
+        expired = []
+        for channel_id, (guild_id, message_id, unlock_time) in self.settings.take_locks().items():
+            guild = self.bot.get_guild(guild_id)
+            if guild is None:
+                continue  # Not a server we can see right now, leave the record alone
+            channel = self.bot.get_channel(channel_id)
+            if channel is None and not guild.unavailable:
+                self.settings.delete_lock(channel_id)  # The channel has been deleted
+                continue
+            # An unavailable server's channels aren't loaded yet, auto_unlock_channel retries until they are
+            self.locked_channels[channel_id] = LockRecord(guild_id, message_id, unlock_time)
+            self.channel_states.transition(channel_id, LOCKED)
+            if channel is not None and not await self.lock_still_in_place(channel):
+                continue
+            if unlock_time is None:
+                continue
+            if unlock_time <= now:
+                expired.append(channel_id)
             else:
-                print(f"{channel.guild.name} - {channel.name} - Channel unlock was scheduled, but another lock action occurred.")
-    
-    async def unlock_channel(self, channel):
-        bot_member = channel.guild.get_member(poketwo_bot_id)
+                self.unlock_scheduler.schedule(channel_id, unlock_time)
+        log.info("Restored %d locked channel(s), %d of them expired while I was away", len(self.locked_channels), len(expired))
+        await self.unlock_in_bulk(expired)
+
+    async def unlock_in_bulk(self, channel_ids, concurrency=5):
+        # The REST dispatcher keeps each channel inside its rate limits, this just bounds how much is queued at once
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def unlock_one(channel_id):
+            async with semaphore:
+                await self.auto_unlock_channel(channel_id)
+
+        await asyncio.gather(*(unlock_one(channel_id) for channel_id in channel_ids))
+
+    async def auto_unlock_channels(self, channel_ids):
+        # Called by the scheduler with every channel that is due at the same moment
+        await asyncio.gather(*(self.auto_unlock_channel(channel_id) for channel_id in channel_ids))
+
+    def retry_auto_unlock(self, channel_id, lock):
+        # Back off so a server that stays down or a permission we keep failing on isn't hammered
+        delay = min(AUTO_UNLOCK_RETRY * 2 ** lock.retries, AUTO_UNLOCK_MAX_RETRY)
+        lock.retries += 1
+        self.unlock_scheduler.schedule(channel_id, time.time() + delay)
+        return delay
+
+    async def auto_unlock_channel(self, channel_id):
+        # The record stays in locked_channels and settings.db until the unlock has gone through
+        lock = self.locked_channels.get(channel_id)
+        if lock is None:
+            return
+        guild = self.bot.get_guild(lock.guild_id)
+        channel = self.bot.get_channel(channel_id)
+        if channel is None:
+            if guild is not None and not guild.unavailable:
+                self.forget_lock(channel_id)  # The channel has been deleted
+            else:
+                delay = self.retry_auto_unlock(channel_id, lock)
+                log.info("Server %s is unavailable, retrying the automatic unlock of %s in %ds", lock.guild_id, channel_id, delay)
+            return
+        try:
+            if not await self.unlock_channel(channel, how=AUTO, record=lock):
+                return  # Unlocked or locked again by someone else while this was waiting
+            await self.send(channel, "The channel has been automatically unlocked due to inactivity. The spawn is now free-for-all to catch.")
+            if lock.message_id:
+                # Only the ID is kept, a partial message is enough to take the stale Unlock button off
+                try:
+                    await self.edit(channel.get_partial_message(lock.message_id), view=None)
+                except discord.NotFound:
+                    pass
+            self.metrics.inc('turo_unlocks_total', kind='auto')
+            log.info("%s - %s - Channel was unlocked due to inactivity", channel.guild.name, channel.name, extra=context(channel, 'auto_unlock'))
+        except discord.HTTPException as e:
+            self.metrics.inc('turo_unlock_failures_total')
+            if self.locked_channels.get(channel_id) is lock:
+                delay = self.retry_auto_unlock(channel_id, lock)
+                log.warning("%s - %s - Failed to automatically unlock channel, retrying in %ds: %s", channel.guild.name, channel.name, delay, e, extra=context(channel, 'auto_unlock_failed'))
+            else:
+                log.warning("%s - %s - Failed to send the automatic unlock notice: %s", channel.guild.name, channel.name, e, extra=context(channel, 'auto_unlock_failed'))
+
+    async def unlock_channel(self, channel, priority=UNLOCK, how=MANUAL, record=None):
+        """Lets Pokétwo back in. Returns False if record was given and is no longer the channel's lock."""
+        async with self.channel_states.locked(channel.id):
+            if record is None:
+                record = self.locked_channels.get(channel.id)
+            elif self.locked_channels.get(channel.id) is not record:
+                return False
+            was_locked = self.channel_states.state(channel.id) == LOCKED or channel.id in self.locked_channels
+            generation = self.channel_states.transition(channel.id, UNLOCKING)
+            try:
+                bot_member = await self.members.poketwo_member(channel.guild)
+                if bot_member is None:
+                    await self.send(channel, ":warning: Unable to find Pokétwo bot to let it back in, check that the bot is a member of the server! Otherwise, I may be missing some permissions.")
+                else:
+                    await self.set_locked(channel, bot_member, False, priority)
+                    if record is not None:
+                        locked_for = time.time() - record.locked_at if record.locked_at is not None else None
+                        self.history.unlock(channel, record.ping_type, how, locked_for)
+                self.forget_lock(channel.id)
+            except BaseException:
+                # Discord still has the channel locked, keep treating pings for it as duplicates
+                if was_locked and self.channel_states.owns(channel.id, generation):
+                    self.channel_states.transition(channel.id, LOCKED)
+                else:
+                    self.channel_states.reset(channel.id, generation)
+                raise
+            self.channel_states.reset(channel.id, generation)
+        return True
+
+    async def set_locked_in_bulk(self, ctx, channels, locked, scope):
+        """Locks or unlocks many channels at once, skipping the ones that are already there.
+
+        Unlocking only touches channels the bot locked, so a channel an admin keeps Pokétwo out of stays that way.
+        """
+        bot_member = await self.members.poketwo_member(ctx.guild)
         if bot_member is None:
-            await channel.send(":warning: Unable to find Pokétwo bot to let it back in, check that the bot is a member of the server! Otherwise, I may be missing some permissions.")
+            await ctx.send(":warning: Unable to find Pokétwo bot, check that the bot is a member of the server! Otherwise, I may be missing some permissions.")
+            return
+        await ctx.defer()
+
+        # Work out everything that needs to change in one pass before touching Discord
+        if locked:
+            changes = [channel for channel in channels if not is_locked(channel.overwrites_for(bot_member))]
         else:
-            overwrite = channel.overwrites_for(bot_member)
-            overwrite.send_messages = True
-            overwrite.read_messages = True
-            overwrite.read_message_history = True
-            await channel.set_permissions(bot_member, overwrite=overwrite)
-        if channel.id in self.locked_channels:
-            del self.locked_channels[channel.id]
+            changes = [channel for channel in channels if channel.id in self.locked_channels or is_locked(channel.overwrites_for(bot_member))]
+        semaphore = asyncio.Semaphore(self.config.get('bulk_concurrency', 5))
+        failed = []
+
+        async def apply(channel):
+            async with semaphore:
+                try:
+                    # Queued below live locks and unlocks so a spawn never waits on maintenance
+                    if locked:
+                        await self.lock_channel_immediately(channel, BULK)
+                    else:
+                        await self.unlock_channel(channel, BULK)
+                except discord.HTTPException as e:
+                    failed.append(f"{channel.mention}: {e}")
+
+        await asyncio.gather(*(apply(channel) for channel in changes))
+        action = "Locked" if locked else "Unlocked"
+        skipped = "already locked" if locked else "not locked"
+        log.info("%s - %s %d channel(s) in %s, %d %s, %d failed", ctx.guild.name, action, len(changes) - len(failed), scope, len(channels) - len(changes), skipped, len(failed))
+        message = f"{action} {len(changes) - len(failed)} channel(s) in {scope}, {len(channels) - len(changes)} were {skipped}."
+        if failed:
+            message += "\nFailed:\n" + "\n".join(failed[:20])
+        await ctx.send(message)
+
+    @commands.hybrid_command(name="lock_category", description="Locks every channel in a category until manually unlocked")
+    @commands.has_guild_permissions(manage_channels=True)
+    @app_commands.describe(category="The category whose channels you want to lock.")
+    async def lock_category(self, ctx, category: discord.CategoryChannel):
+        """Locks every text channel in a category."""
+        await self.set_locked_in_bulk(ctx, category.text_channels, True, category.name)
+
+    @commands.hybrid_command(name="unlock_category", description="Unlocks every locked channel in a category")
+    @commands.has_guild_permissions(manage_channels=True)
+    @app_commands.describe(category="The category whose channels you want to unlock.")
+    async def unlock_category(self, ctx, category: discord.CategoryChannel):
+        """Unlocks every locked text channel in a category."""
+        await self.set_locked_in_bulk(ctx, category.text_channels, False, category.name)
+
+    @commands.hybrid_command(name="unlock_all", description="Unlocks every locked channel in the server")
+    @commands.has_guild_permissions(manage_channels=True)
+    async def unlock_all(self, ctx):
+        """Unlocks every locked text channel in the server."""
+        await self.set_locked_in_bulk(ctx, ctx.guild.text_channels, False, "this server")
     
     @commands.hybrid_command(name="unlock", description="Unlocks the current channel you're in, if locked")
     async def unlock(self, ctx):
-        bot_member = ctx.channel.guild.get_member(poketwo_bot_id)
+        bot_member = await self.members.poketwo_member(ctx.guild)
         if bot_member is None:
-            await ctx.channel.send(":warning: Unable to find Pokétwo bot to let it back in, check that the bot is a member of the server! Otherwise, I may be missing some permissions.")
+            await self.send(ctx.channel, ":warning: Unable to find Pokétwo bot to let it back in, check that the bot is a member of the server! Otherwise, I may be missing some permissions.")
         else:
             overwrite = ctx.channel.overwrites_for(bot_member)
-            if overwrite.send_messages is not False and overwrite.read_messages is not False and overwrite.read_message_history is not False:
+            if is_unlocked(overwrite):
+                # Unlocked by hand, make sure we don't keep treating it as locked
+                self.forget_lock(ctx.channel.id)
+                self.channel_states.reset(ctx.channel.id)
                 await ctx.send("This channel is already unlocked.")
             else:
                 await ctx.send("The channel has been unlocked.")
                 await self.unlock_channel(ctx.channel)
+                self.metrics.inc('turo_unlocks_total', kind='manual')
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild):
+        self.members.forget_guild(guild.id)
+        # Nothing left to unlock there, don't keep retrying
+        for channel_id in [channel_id for channel_id, lock in self.locked_channels.items() if lock.guild_id == guild.id]:
+            self.forget_lock(channel_id)
 
     @commands.Cog.listener()
     async def on_message(self, message):
-        if message.author.id in authorized_ids:
-            content = message.content.lower()
-            lines = content.splitlines()  # Split the message content into lines
-            keywords = ["shiny hunt pings", "collection pings", "rare ping", "regional ping"] # in order of priority of pings
-            server_config = self.get_server_config(message.guild.id)
-            lock_delay = server_config.get('lock_delay', default_lock_delay)
+        received = time.monotonic()
+        config = self.config
+        if message.author.id == config.poketwo_bot_id:
+            self.members.remember_poketwo(message.author)
+            if is_spawn_message(message):
+                self.spawns.set(message.channel.id, message.id)
+            # Only a channel with a running countdown cares about catches
+            if message.channel.id in self.catches.waiters and is_catch_message(message.content):
+                self.catches.dispatch(message.channel.id)
+            return
+        if message.author.id in config.authorized_ids:
+            policy = self.get_policy(message.guild.id)
+            result = policy.classifier.classify(message.content)
+            if result is None:
+                return
+            ping_type, tagged_user_ids = result
+            self.metrics.inc('turo_pings_total', type=ping_type)
+            timings = LockTimings(received)
+            timings.mark('classified')
+            lock_delay = policy.lock_delay
             #print(f'{message.guild.name} - {message.channel.name} - Lock delay: {lock_delay}')
-            has_permissions = False
-
-            for line in lines:
-                for keyword in keywords:
-                    if keyword in line and "@" in line:
-                        # Check if a message from an authorized bot was actioned in the last minute in the same channel
-                        last_actioned = self.last_actioned_message.get(message.channel.id)
-                        current_time = time.time()
-                        self.last_actioned_message[message.channel.id] = current_time
-                        
-                        if last_actioned and (current_time - last_actioned) < 60:
-                            print(f"{message.guild.name} - {message.channel.name} - Ignoring subsequent ping due to cooldown")
-                            return
-                        bot_member = message.channel.guild.get_member(poketwo_bot_id)
-                        if bot_member is None:
-                            await message.channel.send(":warning: Unable to find Pokétwo bot to lock it out, check that the bot is a member of the server! Otherwise, I may be missing some permissions.")
-                            return
-                        ## Check if it's a rare or regional ping first
-                        if keyword == "rare ping":
-                            rare_lock = server_config.get('rare_lock', {'duration': default_rare_lock_duration, 'permanent_lock': True})
-                            if rare_lock.get('permanent_lock', False):
-                                print(f'{message.guild.name} - {message.channel.name} - rare locking until manually unlocked')
-                                lock_duration = None
-                                await self.lock_channel(message.channel, lock_duration, lock_delay)
-                                print(f'{message.guild.name} - {message.channel.name} - keyword checks complete, outcome is lock for {lock_duration} seconds, lock delay is {lock_delay} seconds')
-                                return
-                            elif rare_lock['value'] == 0:
-                                print(f'Ignoring rare hunt ping in {message.channel.name} on {message.guild.name}!')
-                                return
-                            else:
-                                lock_duration = rare_lock.get('value', default_rare_lock_duration)
-                                print(f'{message.guild.name} - {message.channel.name} - rare locking for default duration {default_rare_lock_duration} seconds')
-                                await self.lock_channel(message.channel, lock_duration, lock_delay)
-                                print(f'{message.guild.name} - {message.channel.name} - keyword checks complete, outcome is lock for {lock_duration} seconds, lock delay is {lock_delay} seconds')
-                                return
-                        elif keyword == "regional ping":
-                            regional_lock = server_config.get('regional_lock', {'duration': default_regional_lock_duration, 'permanent_lock': False})
-                            if regional_lock.get('permanent_lock', False):
-                                lock_duration = None
-                                print(f'{message.guild.name} - {message.channel.name} - regional locking until manually unlocked')
-                                await self.lock_channel(message.channel, lock_duration, lock_delay)
-                                print(f'{message.guild.name} - {message.channel.name} - keyword checks complete, outcome is lock for {lock_duration} seconds, lock delay is {lock_delay} seconds')
-                                return
-                            elif regional_lock['value'] == 0:
-                                print(f'Ignoring regional hunt ping in {message.channel.name} on {message.guild.name}!')
-                                return
-                            else:
-                                lock_duration = regional_lock.get('value', default_regional_lock_duration)
-                                print(f'{message.guild.name} - {message.channel.name} - regional locking for default duration {default_regional_lock_duration} seconds')
-                                await self.lock_channel(message.channel, lock_duration, lock_delay)
-                                print(f'{message.guild.name} - {message.channel.name} - keyword checks complete, outcome is lock for {lock_duration} seconds, lock delay is {lock_delay} seconds')
-                                return
-
-                        # If it's not a rare or regional ping, ok, extract mentions from the current line
-                        tagged_user_ids = re.findall(r'<@!?(\d+)>', line)
-                        tagged_users = [message.guild.get_member(int(user_id)) for user_id in tagged_user_ids if message.guild.get_member(int(user_id))]
-
-                        # Check permissions for tagged users
-                        for user in tagged_users:
-                            if user:
-                                permissions = message.channel.permissions_for(user)
-                                if permissions.send_messages:
-                                    has_permissions = True
-                                    # Proceed with channel locking logic
-                                    overwrite = message.channel.overwrites_for(bot_member)
-                                    if overwrite.send_messages is False and overwrite.read_messages is False and overwrite.read_message_history is False:
-                                        print(f'{message.guild.name} - {message.channel.name} - Channel already locked')
-                                        await message.channel.send("The channel is already locked.")
-                                        return
-                                    else:
-                                        print(f'{message.guild.name} - {message.channel.name} - "{keyword}" found')
-                                        if keyword == "shiny hunt pings":
-                                            shiny_lock = server_config.get('shiny_lock', {'duration': default_shiny_lock_duration, 'permanent_lock': False})
-                                            
-                                            # Check if the shiny lock is permanent
-                                            if shiny_lock.get('permanent_lock'):
-                                                print(f'{message.guild.name} - {message.channel.name} - shiny locking until manually unlocked')
-                                                lock_duration = None
-                                            
-                                            # Check if the shiny lock value is 0
-                                            elif shiny_lock.get('value') == 0:
-                                                print(f'Ignoring shiny hunt ping in {message.channel.name} on {message.guild.name}')
-                                                return
-                                            
-                                            # Otherwise, set the lock duration
-                                            else:
-                                                lock_duration = shiny_lock.get('value', default_shiny_lock_duration)
-                                                print(f'{message.guild.name} - {message.channel.name} - shiny locking for {lock_duration} seconds')
-
-                                        else:
-                                            collection_lock = server_config.get('collection_lock', {'duration': default_collection_lock_duration, 'permanent_lock': False})
-                                            if collection_lock.get('permanent_lock', False):
-                                                lock_duration = None
-                                                print(f'{message.guild.name} - {message.channel.name} - collection locking until manually unlocked')
-                                            elif collection_lock['value'] == 0:
-                                                print(f'Ignoring collection hunt ping in {message.channel.name} on {message.guild.name}!!')
-                                                return
-                                            else:
-                                                lock_duration = collection_lock.get('value', default_collection_lock_duration)
-                                                print(f'{message.guild.name} - {message.channel.name} - collection locking for {lock_duration} seconds')
-                                        
-                                        await self.lock_channel(message.channel, lock_duration, lock_delay)
-                                        print(f'{message.guild.name} - {message.channel.name} - keyword checks complete, outcome is lock for {lock_duration} seconds, lock delay is {lock_delay} seconds')
-                                    return  # Exit the loop once a keyword is found to avoid redundant checks
-            if has_permissions == False and tagged_users:
-                await message.channel.send(f":warning: Hunters do not have access to send to this channel, skipping locking!")
+
+            # Helper bots reply to the spawn they are pinging for, otherwise assume it's the last one Pokétwo posted
+            spawn_id = message.reference.message_id if message.reference else self.spawns.get(message.channel.id)
+            if self.channel_states.state(message.channel.id) == LOCKED:
+                await self.lock_still_in_place(message.channel)
+            if self.channel_states.is_duplicate(message.channel.id, spawn_id):
+                self.metrics.inc('turo_skips_total', reason='duplicate')
+                log.info("%s - %s - Ignoring ping, this spawn is already %s", message.guild.name, message.channel.name, self.channel_states.state(message.channel.id), extra=context(message.channel, 'duplicate_ping', ping_type=ping_type))
                 return
-            
+
+            # Check if a message from an authorized bot was actioned in the last minute in the same channel
+            last_actioned = self.last_actioned_message.get(message.channel.id)
+            current_time = time.time()
+
+            if last_actioned and (current_time - last_actioned) < config.ping_cooldown:
+                self.metrics.inc('turo_skips_total', reason='cooldown')
+                self.history.cooldown_skip(message.channel, ping_type)
+                log.info("%s - %s - Ignoring subsequent ping due to cooldown", message.guild.name, message.channel.name, extra=context(message.channel, 'cooldown_skip', ping_type=ping_type))
+                return
+            bot_member = await self.members.poketwo_member(message.guild)
+            if bot_member is None:
+                await self.send(message.channel, ":warning: Unable to find Pokétwo bot to lock it out, check that the bot is a member of the server! Otherwise, I may be missing some permissions.")
+                return
+
+            lock_duration = policy.lock_duration(ping_type)
+            if lock_duration == DISABLED:
+                self.metrics.inc('turo_skips_total', reason='disabled')
+                log.info("Ignoring %s hunt ping in %s on %s", ping_type, message.channel.name, message.guild.name, extra=context(message.channel, 'disabled_ping', ping_type=ping_type))
+                return
+
+            ## Rare and regional pings lock straight away, hunt pings need a hunter who can actually catch it
+            if ping_type not in ("rare", "regional"):
+                # The first hunter who can catch it is enough, so stop resolving members as soon as one turns up
+                mentioned = {member.id: member for member in message.mentions}
+                found_hunter = can_catch = False
+                for user_id in tagged_user_ids:
+                    user = await self.members.hunter(message.guild, user_id, mentioned)
+                    if user is not None:
+                        found_hunter = True
+                        if message.channel.permissions_for(user).send_messages:
+                            can_catch = True
+                            break
+                if not can_catch:
+                    self.metrics.inc('turo_skips_total', reason='no_hunter')
+                    if found_hunter:
+                        await self.send(message.channel, f":warning: Hunters do not have access to send to this channel, skipping locking!")
+                    return
+                overwrite = message.channel.overwrites_for(bot_member)
+                if is_locked(overwrite):
+                    self.metrics.inc('turo_skips_total', reason='already_locked')
+                    log.info("%s - %s - Channel already locked", message.guild.name, message.channel.name, extra=context(message.channel, 'already_locked', ping_type=ping_type))
+                    await self.send(message.channel, "The channel is already locked.")
+                    return
+                log.debug('%s - %s - "%s" ping found', message.guild.name, message.channel.name, ping_type, extra=context(message.channel, 'ping_found', ping_type=ping_type))
+
+            # Another helper bot's ping may have started a lock while we were looking up members
+            if self.channel_states.is_duplicate(message.channel.id, spawn_id):
+                self.metrics.inc('turo_skips_total', reason='duplicate')
+                log.info("%s - %s - Ignoring ping, this spawn is already %s", message.guild.name, message.channel.name, self.channel_states.state(message.channel.id), extra=context(message.channel, 'duplicate_ping', ping_type=ping_type))
+                return
+            # Claim the channel before the first await of the lock pipeline, then start the cooldown now that we're acting on it
+            generation = self.channel_states.transition(message.channel.id, COUNTING_DOWN, spawn_id)
+            self.settings.set_cooldown(message.channel.id, current_time)
+
+            log.info(
+                "%s - %s - %s locking %s, lock delay is %s seconds", message.guild.name, message.channel.name, ping_type,
+                "until manually unlocked" if lock_duration is None else f"for {lock_duration} seconds", lock_delay,
+                extra=context(message.channel, 'lock_started', ping_type=ping_type)
+            )
+            await self.lock_channel(message.channel, lock_duration, lock_delay, timings, policy.fast_lock, generation, ping_type)
+
     @commands.hybrid_command(name="set_shiny_lock_timer", description="Set the auto-unlock duration for shiny locks or make it permanent.")
     @commands.has_guild_permissions(manage_guild=True)
     @app_commands.describe(
@@ -336,7 +682,6 @@ class ChannelManagement(commands.Cog):
             await ctx.send("You cannot set both a lock duration and permanent lock. Please choose one.", ephemeral=True)
             return
         
-        server_config = self.get_server_config(ctx.guild.id)
         self.save_server_config(ctx.guild.id, 'shiny_lock', lock_duration, permanent_lock)
 
         embed = discord.Embed(
@@ -360,7 +705,6 @@ class ChannelManagement(commands.Cog):
             await ctx.send("You cannot set both a lock duration and permanent lock. Please choose one.", ephemeral=True)
             return
         
-        server_config = self.get_server_config(ctx.guild.id)
         self.save_server_config(ctx.guild.id, 'rare_lock', lock_duration, permanent_lock)
 
         embed = discord.Embed(
@@ -384,7 +728,6 @@ class ChannelManagement(commands.Cog):
             await ctx.send("You cannot set both a lock duration and permanent lock. Please choose one.", ephemeral=True)
             return
         
-        server_config = self.get_server_config(ctx.guild.id)
         self.save_server_config(ctx.guild.id, 'regional_lock', lock_duration, permanent_lock)
 
         embed = discord.Embed(
@@ -408,7 +751,6 @@ class ChannelManagement(commands.Cog):
             await ctx.send("You cannot set both a lock duration and permanent lock. Please choose one.", ephemeral=True)
             return
         
-        server_config = self.get_server_config(ctx.guild.id)
         self.save_server_config(ctx.guild.id, 'collection_lock', lock_duration, permanent_lock)
 
         embed = discord.Embed(
@@ -431,14 +773,25 @@ class ChannelManagement(commands.Cog):
             self.save_server_config(ctx.guild.id, 'lock_delay', lock_delay)
             
             await ctx.send(f"Lock delay set to {lock_delay} seconds.")
-        except Exception as e:
-            print(e)
+        except Exception:
+            log.exception("Failed to save the lock delay for %s", ctx.guild.name)
+
+    @commands.hybrid_command(name="set_fast_lock", description="Lock as fast as possible, replacing Pokétwo's channel overwrite when locking.")
+    @commands.has_guild_permissions(manage_guild=True)
+    @app_commands.describe(
+        enabled="Whether to use the fast lock path (True/False)"
+    )
+    async def set_fast_lock(self, ctx, enabled: bool):
+        """Turns the fast lock path on or off for this server."""
+        self.save_server_config(ctx.guild.id, 'fast_lock', enabled)
+        await ctx.send(f"Fast locking {'enabled' if enabled else 'disabled'}.")
 
     @set_shiny_lock_timer.error
     @set_rare_lock_timer.error
     @set_regional_lock_timer.error
     @set_collection_lock_timer.error
     @set_lock_delay.error
+    @set_fast_lock.error
     async def set_timers_error(ctx, error):
         if isinstance(error, MissingPermissions):
             await ctx.reply(':exclamation: You are not the master, you have no control over me!')
@@ -448,69 +801,166 @@ class ChannelManagement(commands.Cog):
     @commands.hybrid_command(name="view_timers", description="View all your timers and lock settings.")
     async def view_timers(self, ctx):
         """Displays all the current timer and lock settings for the server."""
-        server_config = self.get_server_config(ctx.guild.id)
+        policy = self.get_policy(ctx.guild.id)
 
         embed = discord.Embed(
             title="Current timer and lock settings",
             color=discord.Color.blue()
         )
 
-        embed.add_field(name="Lock delay", value=f"{server_config.get('lock_delay', default_lock_delay)} seconds", inline=False)
+        embed.add_field(name="Lock delay", value=f"{policy.lock_delay} seconds", inline=False)
+        for ping_type in ("shiny", "rare", "regional", "collection"):
+            if policy.lock_duration(ping_type) is None:
+                embed.add_field(name=f"{ping_type.capitalize()} lock", value="Permanent", inline=False)
+            else:
+                embed.add_field(name=f"{ping_type.capitalize()} lock duration", value=policy.describe(ping_type), inline=False)
+        embed.add_field(name="Fast lock", value=str(policy.fast_lock), inline=False)
 
-        shiny_lock = server_config.get('shiny_lock', {})
-        if shiny_lock.get('permanent_lock', False or default_shiny_lock_duration == None):
-            embed.add_field(name="Shiny lock", value="Permanent", inline=False)
-        else:
-            embed.add_field(name="Shiny lock duration", value=f"{shiny_lock.get('value', default_shiny_lock_duration)} seconds", inline=False)
+        await ctx.send(embed=embed)
 
-        rare_lock = server_config.get('rare_lock', {})
-        if rare_lock.get('permanent_lock', False or default_rare_lock_duration == None):
-            embed.add_field(name="Rare lock", value="Permanent", inline=False)
-        else:
-            embed.add_field(name="Rare lock duration", value=f"{rare_lock.get('value', default_rare_lock_duration)} seconds", inline=False)
+    @commands.hybrid_command(name="lock_latency", description="View how quickly channels get locked after a ping.")
+    async def lock_latency(self, ctx):
+        """Displays ping-to-lock latency percentiles for the server."""
+        histograms = self.latencies.get(ctx.guild.id)
+        if not histograms:
+            await ctx.send("No channels have been locked since I started.")
+            return
 
-        regional_lock = server_config.get('regional_lock', {})
-        if regional_lock.get('permanent_lock', False or default_regional_lock_duration == None):
-            embed.add_field(name="Regional lock", value="Permanent", inline=False)
-        else:
-            embed.add_field(name="Regional lock duration", value=f"{regional_lock.get('value', default_regional_lock_duration)} seconds", inline=False)
+        embed = discord.Embed(
+            title="Ping-to-lock latency",
+            description=f"Over {histograms['total'].count} lock(s). Overhead is everything except the countdown itself.",
+            color=discord.Color.blue()
+        )
+        for stage, name in (("overhead", "Overhead"), ("classify", "Ping handling"), ("prepare", "Lookups and countdown message"), ("lock", "Permission write"), ("total", "Total")):
+            histogram = histograms[stage]
+            embed.add_field(
+                name=name,
+                value=" / ".join(f"p{p} {histogram.percentile(p) * 1000:.0f} ms" for p in (50, 90, 99)),
+                inline=False
+            )
+        await ctx.send(embed=embed)
 
-        collection_lock = server_config.get('collection_lock', {})
-        if collection_lock.get('permanent_lock', False or default_collection_lock_duration == None):
-            embed.add_field(name="Collection lock", value="Permanent", inline=False)
-        else:
-            embed.add_field(name="Collection lock duration", value=f"{collection_lock.get('value', default_collection_lock_duration)} seconds", inline=False)
+    @commands.hybrid_command(name="lock_stats", description="View how often channels get locked, interrupted and unlocked.")
+    @app_commands.describe(channel="Only show this channel, leave empty for the whole server.")
+    async def lock_stats(self, ctx, channel: discord.TextChannel = None):
+        """Displays lock history totals for the server or one channel."""
+        # Kept up to date as things happen, so this is a few dict lookups however long the history gets
+        totals = self.history.channel(channel.id) if channel else self.history.guild(ctx.guild.id)
+        if totals is None:
+            await ctx.send("Nothing has been locked here yet.")
+            return
 
+        embed = discord.Embed(title=f"Lock stats for {channel.name if channel else ctx.guild.name}", color=discord.Color.blue())
+        embed.add_field(name="Overall", value=describe_totals(totals), inline=False)
+        if channel is None:
+            for ping_type in PING_TYPES:
+                ping_totals = self.history.ping_type(ctx.guild.id, ping_type)
+                if ping_totals is not None:
+                    embed.add_field(name=f"{ping_type.capitalize()} pings", value=describe_totals(ping_totals), inline=False)
         await ctx.send(embed=embed)
 
+def describe_totals(totals):
+    interrupt_rate = f"{totals.interrupt_rate:.0%}" if totals.interrupt_rate is not None else "-"
+    mean_locked = f"{totals.mean_locked / 60:.1f} minutes" if totals.mean_locked is not None else "-"
+    return (
+        f"Locks: {totals.countdown_locks} after a countdown, {totals.immediate_locks} straight away\n"
+        f"Caught during the countdown: {totals.caught} ({interrupt_rate} of finished countdowns)\n"
+        f"Countdowns taken over by a newer spawn: {totals.cancelled}\n"
+        f"Skipped for cooldown: {totals.cooldown_skips}\n"
+        f"Unlocks: {totals.auto_unlocks} automatic, {totals.manual_unlocks} manual\n"
+        f"Mean time locked: {mean_locked}"
+    )
+
 # Creating a sync_channels slash command
 class SyncChannels(commands.Cog):
-    def __init__(self, bot):
+    def __init__(self, bot, rest, config_manager):
         self.bot = bot
+        self.rest = rest  # Shared with ChannelManagement so syncing never starves a lock
+        self.config_manager = config_manager
 
-    @app_commands.command(name="sync_channels", description="Sync permissions of all channels in a category with the category.")
-    @commands.has_guild_permissions(manage_channels=True)
-    @app_commands.describe(category="The category whose channels' permissions you want to sync.")
-    async def sync_channels(self, interaction: discord.Interaction, category: discord.CategoryChannel):
-        # Check if the user has the necessary permissions to manage channels
-        #if not interaction.user.guild_permissions.manage_channels:
-        #    await interaction.response.send_message("You do not have permission to manage channels.", ephemeral=True)
-        #    return
-
-        # Sync permissions for all channels in the category
-        failed_channels = []
-        for channel in category.channels:
-            try:
-                await channel.edit(sync_permissions=True)
-            except Exception as e:
-                failed_channels.append(channel.name)
-                print(f"Failed to sync {channel.name}: {e}")
-
-        if failed_channels:
-            await interaction.response.send_message(f"Failed to sync the following channels: {', '.join(failed_channels)}")
+    @app_commands.command(name="sync_channels", description="Sync permissions of channels with their category.")
+    @app_commands.checks.has_permissions(manage_channels=True)
+    @app_commands.describe(
+        category="The category whose channels' permissions you want to sync.",
+        category_2="Another category to sync at the same time.",
+        category_3="Another category to sync at the same time.",
+        whole_server="Sync every channel in the server that belongs to a category."
+    )
+    async def sync_channels(
+        self,
+        interaction: discord.Interaction,
+        category: discord.CategoryChannel = None,
+        category_2: discord.CategoryChannel = None,
+        category_3: discord.CategoryChannel = None,
+        whole_server: bool = False
+    ):
+        if whole_server:
+            categories = list(interaction.guild.categories)
+            scope = "this server"
         else:
-            await interaction.response.send_message(f"Successfully synced all channels in the category {category.name}.")
-            
+            categories = list(dict.fromkeys(c for c in (category, category_2, category_3) if c is not None))
+            scope = ", ".join(c.name for c in categories)
+        if not categories:
+            await interaction.response.send_message("Pick at least one category, or set whole_server to True.", ephemeral=True)
+            return
+
+        # Answer within Discord's 3 seconds, the actual syncing can take a while
+        await interaction.response.defer(thinking=True)
+
+        channels = [channel for c in categories for channel in c.channels]
+        summary = {'synced': [], 'already_synced': [], 'failed': []}
+        to_sync = []
+        for channel in channels:
+            if channel.permissions_synced:
+                summary['already_synced'].append(channel)
+            else:
+                to_sync.append(channel)
+
+        progress = await interaction.followup.send(f"Syncing {len(to_sync)} channel(s) in {scope}...", wait=True)
+        semaphore = asyncio.Semaphore(self.config_manager.config.get('sync_concurrency', 5))
+        last_update = time.monotonic()
+
+        async def sync_one(channel):
+            nonlocal last_update
+            async with semaphore:
+                try:
+                    await self.rest.run(BULK, ('channels', channel.id), lambda: channel.edit(sync_permissions=True))
+                    summary['synced'].append(channel)
+                except Exception as e:
+                    summary['failed'].append((channel, str(e)))
+                    log.warning("Failed to sync %s: %s", channel.name, e, extra=context(channel, 'sync_failed'))
+            # Keep the follow-up moving without spending a request per channel
+            if time.monotonic() - last_update >= 2:
+                last_update = time.monotonic()
+                done = len(summary['synced']) + len(summary['failed'])
+                try:
+                    await progress.edit(content=f"Syncing channels in {scope}... {done}/{len(to_sync)} done, {len(summary['failed'])} failed.")
+                except discord.HTTPException:
+                    pass
+
+        await asyncio.gather(*(sync_one(channel) for channel in to_sync))
+
+        embed = discord.Embed(
+            title=f"Channel sync for {scope}",
+            color=discord.Color.red() if summary['failed'] else discord.Color.green()
+        )
+        embed.add_field(name="Synced", value=str(len(summary['synced'])), inline=True)
+        embed.add_field(name="Already in sync", value=str(len(summary['already_synced'])), inline=True)
+        embed.add_field(name="Failed", value=str(len(summary['failed'])), inline=True)
+        if summary['failed']:
+            lines = [f"{channel.mention}: {reason}" for channel, reason in summary['failed']]
+            details = "\n".join(lines)
+            if len(details) > 1024:
+                details = details[:1000].rsplit("\n", 1)[0] + "\n...and more"
+            embed.add_field(name="Failures", value=details, inline=False)
+        await progress.edit(content=None, embed=embed)
+
 async def setup(bot):
-    await bot.add_cog(ChannelManagement(bot))
-    await bot.add_cog(SyncChannels(bot))
\ No newline at end of file
+    # One handler for every Unlock button, old lock messages included
+    bot.add_dynamic_items(UnlockButton)
+    channel_management = ChannelManagement(bot)
+    await bot.add_cog(channel_management)
+    await bot.add_cog(SyncChannels(bot, channel_management.rest, channel_management.config_manager))
+
+async def teardown(bot):
+    bot.remove_dynamic_items(UnlockButton)
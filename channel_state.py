@@ -0,0 +1,90 @@
+import asyncio, contextlib
+
+IDLE = 'idle'
+COUNTING_DOWN = 'counting down'
+LOCKED = 'locked'
+UNLOCKING = 'unlocking'
+
+class ChannelState:
+    """Where a channel is in the lock pipeline, and which spawn it is handling."""
+
+    __slots__ = ('state', 'spawn_id', 'generation', 'lock', 'users')
+
+    def __init__(self):
+        self.state = IDLE
+        self.spawn_id = None
+        self.generation = 0  # Bumped by every transition, so a pipeline can tell it has been overtaken
+        self.lock = asyncio.Lock()  # Held while a transition is talking to Discord
+        self.users = 0  # Holding or waiting for the lock, the entry is kept while there are any
+
+class ChannelStates:
+    """Per-channel state machines: idle -> counting down -> locked -> unlocking -> idle.
+
+    Checks and transitions never await, so two pings handled back to back
+    can't both see an idle channel. Channels that go back to idle are dropped
+    so this only holds the channels that are busy.
+    """
+
+    def __init__(self):
+        self.channels = {}
+
+    def __len__(self):
+        return len(self.channels)
+
+    def get(self, channel_id):
+        state = self.channels.get(channel_id)
+        if state is None:
+            state = self.channels[channel_id] = ChannelState()
+        return state
+
+    def state(self, channel_id):
+        state = self.channels.get(channel_id)
+        return state.state if state is not None else IDLE
+
+    def is_duplicate(self, channel_id, spawn_id):
+        """Whether a ping is for a spawn that already has a lock pipeline."""
+        state = self.channels.get(channel_id)
+        if state is None or state.state == IDLE:
+            return False
+        if state.state == COUNTING_DOWN:
+            # A ping for a different, newer spawn takes over the countdown
+            return spawn_id is None or state.spawn_id is None or spawn_id == state.spawn_id
+        return True
+
+    def transition(self, channel_id, new_state, spawn_id=None):
+        """Moves a channel to a new state and returns the generation that owns it."""
+        state = self.get(channel_id)
+        state.state = new_state
+        state.spawn_id = spawn_id
+        state.generation += 1
+        return state.generation
+
+    @contextlib.asynccontextmanager
+    async def locked(self, channel_id):
+        """Holds a channel's lock, dropping the channel on the way out if it ended up idle and nobody else wants it."""
+        state = self.get(channel_id)
+        state.users += 1
+        try:
+            async with state.lock:
+                yield state
+        finally:
+            state.users -= 1
+            if not state.users and state.state == IDLE and self.channels.get(channel_id) is state:
+                del self.channels[channel_id]
+
+    def owns(self, channel_id, generation):
+        state = self.channels.get(channel_id)
+        return state is not None and state.generation == generation
+
+    def reset(self, channel_id, generation=None):
+        """Back to idle, unless a newer transition has taken the channel over since generation."""
+        state = self.channels.get(channel_id)
+        if state is None or (generation is not None and state.generation != generation):
+            return
+        if state.users:
+            # Someone holds or waits for this entry's lock, locked() drops it once they're done
+            state.state = IDLE
+            state.spawn_id = None
+            state.generation += 1
+        else:
+            del self.channels[channel_id]
@@ -0,0 +1,47 @@
+import hashlib, json, os
+
+def tree_fingerprint(tree, guild=None):
+    """Hash of the payload tree.sync() would send, so any change to a command, option or description shows up."""
+    payload = sorted((command.to_dict(tree) for command in tree.get_commands(guild=guild)), key=lambda command: (command.get('type', 1), command['name']))
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+class CommandSync:
+    """Syncs the slash command tree only when it differs from what was last synced.
+
+    Fingerprints are kept in a small JSON file per application, under 'global'
+    for global commands and the server ID for per-server syncs.
+    """
+
+    def __init__(self, tree, path):
+        self.tree = tree
+        self.path = path
+        self.fingerprints = {}
+        if os.path.exists(path):
+            try:
+                with open(path) as f:
+                    self.fingerprints = json.load(f)
+            except (OSError, ValueError):
+                self.fingerprints = {}  # A broken file just means syncing once more
+
+    def _scope(self, guild):
+        synced = self.fingerprints.setdefault(str(self.tree.client.application_id), {})
+        return synced, 'global' if guild is None else str(guild.id)
+
+    async def sync(self, guild=None, force=False):
+        """Syncs if anything changed. Returns the synced commands, or None if there was nothing to do."""
+        fingerprint = tree_fingerprint(self.tree, guild)
+        synced, scope = self._scope(guild)
+        if not force and synced.get(scope) == fingerprint:
+            return None
+        commands = await self.tree.sync(guild=guild)
+        synced[scope] = fingerprint
+        self._save()
+        return commands
+
+    def _save(self):
+        # Written to a temporary file first so a crash never leaves half a file behind,
+        # named per process as launcher.py's workers share the same file
+        temporary = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary, 'w') as f:
+            json.dump(self.fingerprints, f, indent=4)
+        os.replace(temporary, self.path)
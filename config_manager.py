@@ -0,0 +1,133 @@
+import asyncio, json, logging, os
+
+log = logging.getLogger('turo.config')
+
+def valid_id(value):
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+def valid_duration(value):
+    # None locks until someone unlocks manually
+    return value is None or (isinstance(value, int) and not isinstance(value, bool) and value >= 0)
+
+class BotConfig:
+    """One validated, read-only snapshot of config.json.
+
+    The cog holds on to a snapshot and ConfigManager replaces it whole, so a
+    message is always handled with one consistent set of IDs and defaults.
+    Settings that only matter at startup are read through get().
+    """
+
+    __slots__ = ('raw', 'owner', 'poketwo_bot_id', 'authorized_ids', 'defaults', 'ping_cooldown')
+
+    def __init__(self, raw):
+        problems = []
+        for key in ('owner', 'pokename', 'poketox', 'p2assistant', 'poketwo_bot_id'):
+            if not valid_id(raw.get(key)):
+                problems.append(f"'{key}' must be a Discord ID")
+        if not isinstance(raw.get('lock_delay'), int) or isinstance(raw.get('lock_delay'), bool) or raw.get('lock_delay') < 0:
+            problems.append("'lock_delay' must be a whole number of seconds")
+        for key in ('shiny_lock_duration', 'regional_lock_duration', 'collection_lock_duration'):
+            if key not in raw or not valid_duration(raw[key]):
+                problems.append(f"'{key}' must be a whole number of seconds, or null to lock until unlocked manually")
+        if not isinstance(raw.get('fast_lock', False), bool):
+            problems.append("'fast_lock' must be true or false")
+        ping_cooldown = raw.get('ping_cooldown', 60)
+        if isinstance(ping_cooldown, bool) or not isinstance(ping_cooldown, (int, float)) or ping_cooldown < 0:
+            problems.append("'ping_cooldown' must be a number of seconds")
+        if problems:
+            raise ValueError("; ".join(problems))
+
+        object.__setattr__(self, 'raw', raw)
+        object.__setattr__(self, 'owner', raw['owner'])
+        object.__setattr__(self, 'poketwo_bot_id', raw['poketwo_bot_id'])
+        object.__setattr__(self, 'authorized_ids', frozenset((raw['pokename'], raw['poketox'], raw['p2assistant'])))
+        # Default timeout durations, overridden by server-specific settings
+        object.__setattr__(self, 'defaults', {
+            'lock_delay': raw['lock_delay'],
+            'shiny_lock_duration': raw['shiny_lock_duration'],
+            'rare_lock_duration': None,
+            'regional_lock_duration': raw['regional_lock_duration'],
+            'collection_lock_duration': raw['collection_lock_duration'],
+            'fast_lock': raw.get('fast_lock', False),
+        })
+        object.__setattr__(self, 'ping_cooldown', ping_cooldown)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("BotConfig is read-only, edit config.json instead")
+
+    def __getitem__(self, key):
+        return self.raw[key]
+
+    def get(self, key, default=None):
+        return self.raw.get(key, default)
+
+def load_config(path):
+    with open(path) as f:
+        return BotConfig(json.load(f))
+
+class ConfigManager:
+    """Keeps the current BotConfig and swaps in a new one when config.json changes on disk.
+
+    An edit that doesn't parse or validate is logged and ignored, the bot
+    keeps running on the last good config. Subscribers are called with
+    (new, old) after every swap.
+    """
+
+    def __init__(self, path, interval=5.0):
+        self.path = path
+        self.interval = interval
+        self._mtime = os.stat(path).st_mtime_ns
+        self.config = load_config(path)
+        self._subscribers = []
+        self._task = None
+
+    def subscribe(self, callback):
+        self._subscribers.append(callback)
+
+    def unsubscribe(self, callback):
+        if callback in self._subscribers:
+            self._subscribers.remove(callback)
+
+    def reload(self):
+        """Loads and swaps in config.json straight away, raising if it's unreadable or invalid."""
+        mtime = os.stat(self.path).st_mtime_ns
+        new = load_config(self.path)
+        self._mtime = mtime
+        old, self.config = self.config, new
+        for callback in list(self._subscribers):
+            try:
+                callback(new, old)
+            except Exception:
+                log.exception("Config subscriber %r failed", callback)
+        return new
+
+    def check(self):
+        """Reloads if config.json changed since the last look. Returns True if a new config was swapped in."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        try:
+            self.reload()
+        except (OSError, ValueError) as e:
+            self._mtime = mtime  # Don't complain again until the file changes
+            log.warning("Ignoring the change to %s, keeping the last good config: %s", self.path, e)
+            return False
+        log.info("Reloaded %s", self.path)
+        return True
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._watch())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            self.check()
@@ -0,0 +1,39 @@
+class MessageFilter:
+    """Drops MESSAGE_CREATE payloads the cog would ignore before discord.py builds a Message.
+
+    discord.py turns every gateway message into a Message object (and keeps it
+    in the message cache) before any listener can look at the author. In busy
+    spawn channels almost all of that is chatter, so this wraps the raw
+    MESSAGE_CREATE parser and only lets through messages from the bots we
+    watch, plus anything that looks like a prefix command.
+    """
+
+    def __init__(self, allowed_ids, prefixes=()):
+        self.allowed_ids = frozenset(str(user_id) for user_id in allowed_ids)  # Gateway payloads carry IDs as strings
+        self.prefixes = tuple(prefixes)
+        self.passed = 0
+        self.dropped = 0
+
+    def update(self, allowed_ids):
+        # Swapped in one assignment, so a message is always checked against a complete set
+        self.allowed_ids = frozenset(str(user_id) for user_id in allowed_ids)
+
+    def wants(self, data):
+        author = data.get('author')
+        if author is not None and author.get('id') in self.allowed_ids:
+            return True
+        return bool(self.prefixes) and data.get('content', '').startswith(self.prefixes)
+
+    def install(self, client):
+        # The gateway looks parsers up in this same dict, so replacing the entry is enough
+        parsers = client._connection.parsers
+        parse_message_create = parsers['MESSAGE_CREATE']
+
+        def filtered(data):
+            if self.wants(data):
+                self.passed += 1
+                parse_message_create(data)
+            else:
+                self.dropped += 1
+
+        parsers['MESSAGE_CREATE'] = filtered
@@ -0,0 +1,88 @@
+import bisect, time
+
+# Bucket upper bounds in seconds, roughly logarithmic from 1 ms to 10 minutes
+BUCKETS = [b * scale for scale in (0.001, 0.01, 0.1, 1, 10, 100) for b in (1, 2, 5)] + [1000.0]
+
+class LatencyHistogram:
+    """Fixed-bucket histogram, cheap enough to update on every lock."""
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, percent):
+        """Upper bound of the bucket holding the given percentile, or None if nothing was recorded."""
+        if not self.count:
+            return None
+        target = self.count * percent / 100
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= target:
+                return BUCKETS[index] if index < len(BUCKETS) else self.max
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+class LockTimings:
+    """Monotonic timestamps for each stage between a ping arriving and the lock landing."""
+
+    __slots__ = ('received', 'classified', 'countdown_started', 'delay_expired', 'locked')
+
+    def __init__(self, received=None):
+        self.received = received if received is not None else time.monotonic()
+        self.classified = None
+        self.countdown_started = None
+        self.delay_expired = None
+        self.locked = None
+
+    def mark(self, stage):
+        setattr(self, stage, time.monotonic())
+
+    def stages(self):
+        """Seconds spent in each stage, 'overhead' being everything except the countdown itself.
+
+        'prepare' covers the member lookups and, outside fast mode, posting the countdown message.
+        """
+        countdown_started = self.countdown_started if self.countdown_started is not None else self.classified
+        stages = {
+            'classify': self.classified - self.received,
+            'prepare': countdown_started - self.classified,
+            'delay': self.delay_expired - countdown_started,
+            'lock': self.locked - self.delay_expired,
+            'total': self.locked - self.received,
+        }
+        stages['overhead'] = stages['total'] - stages['delay']
+        return stages
+
+class GuildLatencies:
+    """Ping-to-lock histograms for each server, one per stage."""
+
+    def __init__(self):
+        self.guilds = {}
+
+    def record(self, guild_id, timings):
+        histograms = self.guilds.get(guild_id)
+        if histograms is None:
+            histograms = self.guilds[guild_id] = {}
+        for stage, seconds in timings.stages().items():
+            histogram = histograms.get(stage)
+            if histogram is None:
+                histogram = histograms[stage] = LatencyHistogram()
+            histogram.record(seconds)
+
+    def get(self, guild_id):
+        return self.guilds.get(guild_id, {})
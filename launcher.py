@@ -0,0 +1,54 @@
+import json, os, subprocess, sys, time, urllib.request
+
+# Splits the bot's shards across several processes, each one running main.py for its own range.
+# They all share settings.db, so locks, cooldowns and server settings carry over if shards move.
+
+base_dir = os.path.dirname(os.path.abspath(__file__))
+config_path = os.path.join(base_dir, 'config.json')
+
+with open(config_path) as f:
+    config = json.load(f)
+
+def recommended_shard_count(token):
+    request = urllib.request.Request(
+        "https://discord.com/api/v10/gateway/bot",
+        headers={'Authorization': f"Bot {token}", 'User-Agent': "DiscordBot (Turo, 1.2.3)"}
+    )
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)['shards']
+
+def shard_ranges(shard_count, processes):
+    """Splits shard IDs into contiguous ranges, as evenly as possible."""
+    processes = max(1, min(processes, shard_count))
+    size, extra = divmod(shard_count, processes)
+    ranges, start = [], 0
+    for index in range(processes):
+        end = start + size + (1 if index < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+def start_worker(shard_ids, shard_count):
+    env = dict(os.environ, TURO_SHARD_IDS=','.join(map(str, shard_ids)), TURO_SHARD_COUNT=str(shard_count))
+    print(f"Starting shards {shard_ids[0]}-{shard_ids[-1]} of {shard_count}")
+    return subprocess.Popen([sys.executable, os.path.join(base_dir, 'main.py')], env=env, cwd=base_dir)
+
+def main():
+    shard_count = config.get('shard_count') or recommended_shard_count(config['token'])
+    ranges = shard_ranges(shard_count, config.get('processes', os.cpu_count() or 1))
+    workers = {index: start_worker(shard_ids, shard_count) for index, shard_ids in enumerate(ranges)}
+    try:
+        while True:
+            time.sleep(5)
+            for index, worker in workers.items():
+                if worker.poll() is not None:
+                    print(f"Shards {ranges[index][0]}-{ranges[index][-1]} exited with code {worker.returncode}, restarting")
+                    workers[index] = start_worker(ranges[index], shard_count)
+    except KeyboardInterrupt:
+        for worker in workers.values():
+            worker.terminate()
+        for worker in workers.values():
+            worker.wait()
+
+if __name__ == "__main__":
+    main()
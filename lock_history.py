@@ -0,0 +1,165 @@
+import asyncio, json, logging, os, time
+from concurrent.futures import ThreadPoolExecutor
+
+log = logging.getLogger('turo.history')
+
+# What can happen to a channel, as written to the event log
+LOCK = 'lock'
+INTERRUPT = 'interrupt'
+COOLDOWN_SKIP = 'cooldown_skip'
+UNLOCK = 'unlock'
+
+# How a channel got unlocked
+AUTO = 'auto'
+MANUAL = 'manual'
+
+class LockTotals:
+    """Running totals for one server, channel or ping type, updated as events come in."""
+
+    # Countdowns end in a countdown lock, a catch or another ping taking over (cancelled),
+    # immediate locks from /lock and /lock_category never had a countdown
+    __slots__ = ('countdown_locks', 'immediate_locks', 'caught', 'cancelled', 'cooldown_skips', 'auto_unlocks', 'manual_unlocks', 'locked_seconds', 'timed_unlocks')
+
+    def __init__(self, data=None):
+        for name in self.__slots__:
+            setattr(self, name, (data or {}).get(name, 0))
+
+    def as_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    @property
+    def locks(self):
+        return self.countdown_locks + self.immediate_locks
+
+    @property
+    def interrupt_rate(self):
+        # Share of countdowns that a catch beat to the lock, cancelled ones never had the chance to finish either way
+        countdowns = self.countdown_locks + self.caught
+        return self.caught / countdowns if countdowns else None
+
+    @property
+    def mean_locked(self):
+        return self.locked_seconds / self.timed_unlocks if self.timed_unlocks else None
+
+def totals_keys(guild_id, channel_id, ping_type):
+    keys = [f'guild:{guild_id}', f'channel:{channel_id}']
+    if ping_type is not None:
+        keys.append(f'ping_type:{guild_id}:{ping_type}')
+    return keys
+
+class LockHistory:
+    """Append-only JSON lines log of what the cog did, plus totals kept up to date as it happens.
+
+    Recording an event only updates a few counters and queues a line, the file
+    write happens in batches on a writer thread and rolls over to
+    history.jsonl.1, .2, ... once it passes max_bytes. The totals are saved
+    in settings.db, so /lock_stats never has to read the log.
+    """
+
+    def __init__(self, path, settings, max_bytes=10 * 1024 * 1024, backups=5, flush_delay=2.0):
+        self.path = path
+        self.settings = settings
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_delay = flush_delay
+        self.totals = {key: LockTotals(data) for key, data in settings.stats.items()}
+        self._pending = []  # event log lines waiting to be written
+        self._dirty = set()  # totals keys changed since the last flush
+        self._flush_task = None
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-writer")
+
+    def guild(self, guild_id):
+        return self.totals.get(f'guild:{guild_id}')
+
+    def channel(self, channel_id):
+        return self.totals.get(f'channel:{channel_id}')
+
+    def ping_type(self, guild_id, ping_type):
+        return self.totals.get(f'ping_type:{guild_id}:{ping_type}')
+
+    def _totals(self, key):
+        totals = self.totals.get(key)
+        if totals is None:
+            totals = self.totals[key] = LockTotals()
+        self._dirty.add(key)
+        return totals
+
+    def record(self, event, channel, ping_type=None, **fields):
+        """Logs an event for a channel and folds it into the totals."""
+        self._pending.append({'time': round(time.time(), 3), 'event': event, 'guild_id': channel.guild.id, 'channel_id': channel.id, 'ping_type': ping_type, **fields})
+        for key in totals_keys(channel.guild.id, channel.id, ping_type):
+            totals = self._totals(key)
+            if event == LOCK:
+                if fields.get('kind') == 'immediate':
+                    totals.immediate_locks += 1
+                else:
+                    totals.countdown_locks += 1
+            elif event == INTERRUPT:
+                if fields.get('reason') == 'cancelled':
+                    totals.cancelled += 1
+                else:
+                    totals.caught += 1
+            elif event == COOLDOWN_SKIP:
+                totals.cooldown_skips += 1
+            elif event == UNLOCK:
+                if fields.get('how') == AUTO:
+                    totals.auto_unlocks += 1
+                else:
+                    totals.manual_unlocks += 1
+                if fields.get('locked_for') is not None:
+                    totals.locked_seconds += fields['locked_for']
+                    totals.timed_unlocks += 1
+        self._schedule_flush()
+
+    def lock(self, channel, ping_type=None, kind='countdown'):
+        self.record(LOCK, channel, ping_type, kind=kind)
+
+    def interrupt(self, channel, ping_type=None, reason='caught'):
+        self.record(INTERRUPT, channel, ping_type, reason=reason)
+
+    def cooldown_skip(self, channel, ping_type=None):
+        self.record(COOLDOWN_SKIP, channel, ping_type)
+
+    def unlock(self, channel, ping_type=None, how=MANUAL, locked_for=None):
+        self.record(UNLOCK, channel, ping_type, how=how, locked_for=round(locked_for, 3) if locked_for is not None else None)
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self):
+        while self._pending or self._dirty:
+            await asyncio.sleep(self.flush_delay)
+            await self.flush()
+
+    async def flush(self):
+        for key in self._dirty:
+            self.settings.save_stats(key, self.totals[key].as_dict())
+        self._dirty.clear()
+        if not self._pending:
+            return
+        lines = "".join(json.dumps(event) + "\n" for event in self._pending)
+        self._pending = []
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._append, lines)
+        except OSError as e:
+            # The totals are already safe in settings.db, losing a batch of log lines is the lesser evil
+            log.warning("Failed to write lock history to %s: %s", self.path, e)
+
+    def _append(self, lines):
+        if os.path.exists(self.path) and os.path.getsize(self.path) + len(lines) > self.max_bytes:
+            self._rotate()
+        with open(self.path, 'a') as f:
+            f.write(lines)
+
+    def _rotate(self):
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    async def close(self):
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+        self._executor.shutdown(wait=True)
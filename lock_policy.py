@@ -0,0 +1,49 @@
+from ping_classifier import build_classifier
+
+# Resolved lock durations: None locks until someone unlocks manually, 0 ignores the ping
+PERMANENT = None
+DISABLED = 0
+
+PING_TYPES = ('shiny', 'rare', 'regional', 'collection')
+
+def resolve_duration(entry, default):
+    """Turns a raw '<type>_lock' settings entry into PERMANENT, DISABLED or a number of seconds."""
+    if not isinstance(entry, dict):
+        return default
+    if entry.get('permanent_lock'):
+        return PERMANENT
+    # Older entries and the built-in fallbacks used 'duration' instead of 'value'
+    value = entry.get('value', entry.get('duration'))
+    if isinstance(value, bool) or not isinstance(value, int) or value < 0:
+        return default
+    return value
+
+class GuildLockPolicy:
+    """Everything on_message needs to know about a server, resolved once from its settings."""
+
+    __slots__ = ('lock_delay', 'shiny', 'rare', 'regional', 'collection', 'fast_lock', 'classifier')
+
+    def __init__(self, server_config, defaults):
+        lock_delay = server_config.get('lock_delay')
+        if isinstance(lock_delay, bool) or not isinstance(lock_delay, int) or lock_delay < 0:
+            lock_delay = defaults['lock_delay']
+        object.__setattr__(self, 'lock_delay', lock_delay)
+        for ping_type in PING_TYPES:
+            duration = resolve_duration(server_config.get(f'{ping_type}_lock'), defaults[f'{ping_type}_lock_duration'])
+            object.__setattr__(self, ping_type, duration)
+        object.__setattr__(self, 'fast_lock', bool(server_config.get('fast_lock', defaults.get('fast_lock', False))))
+        object.__setattr__(self, 'classifier', build_classifier(server_config.get('ping_keywords')))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("GuildLockPolicy is read-only, save the server config instead")
+
+    def lock_duration(self, ping_type):
+        return getattr(self, ping_type)
+
+    def describe(self, ping_type):
+        duration = getattr(self, ping_type)
+        if duration is PERMANENT:
+            return "Permanent"
+        if duration == DISABLED:
+            return "Disabled"
+        return f"{duration} seconds"
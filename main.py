@@ -1,34 +1,113 @@
 import discord
 from discord.ext import commands
 from discord.ext.commands import MissingPermissions
-import json
 import os
 import asyncio
+import logging
+import resource
+from member_cache import bot_options, FULL
+from gateway_filter import MessageFilter
+from bot_logging import setup_logging
+from metrics import Metrics
+from profiling import cprofile_for, sample_for, MemorySnapshots, LoopWatchdog
+from command_sync import CommandSync
+from config_manager import ConfigManager
 
 # Load the configuration file
 base_dir = os.path.dirname(os.path.abspath(__file__))
-config_path = os.path.join(base_dir, 'config.json')
+# TURO_CONFIG points at a different config file, e.g. for the replay benchmark
+config_path = os.environ.get('TURO_CONFIG') or os.path.join(base_dir, 'config.json')
 
-with open(config_path) as f:
-    config = json.load(f)
+# Watched while the bot runs, so helper bot IDs and default timers can change without a restart
+config_manager = ConfigManager(config_path)
+config = config_manager.config  # The startup snapshot, for things that only matter when the bot starts
+
+# Logs are written from a background thread, set 'log_json' for one JSON object per line
+# 'log_sample_rates' keeps 1 in N of the noisiest events, e.g. {"duplicate_ping": 10}
+log_listener = setup_logging(config.get('log_level', 'INFO'), config.get('log_json', False), config.get('log_sample_rates'))
+log = logging.getLogger('turo')
 
 intents = discord.Intents.default()
 intents.messages = True
 intents.message_content = True  # Enable the message content intent
-intents.members = True
-bot = commands.Bot(command_prefix="!", intents=intents)
+# 'full' chunks every member of every server at startup, 'lean' only keeps Pokétwo and recently pinged hunters
+options = bot_options(config.get('member_cache', FULL), intents)
+# None turns the message cache off, the cog never needs old messages
+max_messages = config.get('max_messages', 1000) or None
+
+# Shards this process runs, launcher.py passes them in through the environment when it splits shards across processes
+shard_count = int(os.environ.get('TURO_SHARD_COUNT') or config.get('shard_count') or 0) or None
+shard_ids = os.environ.get('TURO_SHARD_IDS')
+shard_ids = [int(shard_id) for shard_id in shard_ids.split(',')] if shard_ids else config.get('shard_ids')
+# Rate limits longer than max_ratelimit_timeout come back to us as discord.RateLimited so the lock queue can reschedule instead of stalling
+if config.get('sharded', False) or shard_count or shard_ids:
+    # AutoShardedBot asks Discord for a shard count itself if none is given
+    bot = commands.AutoShardedBot(command_prefix="!", shard_count=shard_count, shard_ids=shard_ids, max_ratelimit_timeout=config.get('max_ratelimit_timeout', 30.0), max_messages=max_messages, **options)
+else:
+    bot = commands.Bot(command_prefix="!", max_ratelimit_timeout=config.get('max_ratelimit_timeout', 30.0), max_messages=max_messages, **options)
+
+# Skip building Message objects for anyone but the bots the cog listens to, prefix commands still get through
+bot.message_filter = None
+if config.get('prefilter_messages', True):
+    bot.message_filter = MessageFilter(
+        [config['pokename'], config['poketox'], config['p2assistant'], config['poketwo_bot_id']],
+        prefixes=["!"]
+    )
+    bot.message_filter.install(bot)
+
+    def update_message_filter(new, old):
+        bot.message_filter.update([new['pokename'], new['poketox'], new['p2assistant'], new['poketwo_bot_id']])
+
+    config_manager.subscribe(update_message_filter)
+bot.config_manager = config_manager
+
+# Lives on the bot rather than the cog so counters survive /restart
+bot.metrics = Metrics()
+bot.metrics.describe('turo_pings_total', 'Hunt pings recognised, by ping type')
+bot.metrics.describe('turo_locks_total', 'Channels locked, by countdown or straight away')
+bot.metrics.describe('turo_unlocks_total', 'Channels unlocked, by how')
+bot.metrics.describe('turo_interrupts_total', 'Lock countdowns stopped by a catch or another lock action')
+bot.metrics.describe('turo_skips_total', 'Pings that did not lead to a lock, by reason')
+bot.metrics.describe('turo_lock_delay_seconds', 'Time actually spent counting down before locking')
+bot.metrics.describe('turo_lock_stage_seconds', 'Ping-to-lock time spent in each stage')
+bot.metrics.describe('turo_rest_request_seconds', 'Discord REST request latency, by bucket kind')
 
 @bot.event
 async def on_ready():
-    print(f'Logged in as {bot.user}')
+    log.info('Logged in as %s%s', bot.user, f' running shards {sorted(bot.shards)} of {bot.shard_count}' if bot.shard_count else '')
     await bot.change_presence(activity=discord.CustomActivity(name='Turov1.2.3' ,emoji='🖥️'))
 
+# Fingerprints of the last synced command tree, so unchanged commands are never synced again
+command_sync = CommandSync(bot.tree, config.get('command_sync_path', os.path.join(base_dir, 'command_sync.json')))
+
+async def setup_hook():
+    config_manager.start()
+    # Global commands are shared by every shard, so with launcher.py only the process running shard 0 syncs them
+    if shard_ids and 0 not in shard_ids:
+        return
+    # Runs after login with the extension already loaded, so the tree is complete
+    commands_synced = await command_sync.sync()
+    if commands_synced is None:
+        log.info("Slash commands unchanged, skipping sync")
+    else:
+        log.info("Synced %d slash command(s)", len(commands_synced))
+
+bot.setup_hook = setup_hook
+
 @bot.hybrid_command()
 @commands.has_guild_permissions(manage_guild=True)
-async def sync(ctx):
-    """Syncs the slash commands."""
-    print(f"Running sync command on {ctx.guild.name}")
-    await bot.tree.sync()
+async def sync(ctx, this_server: bool = False, force: bool = False):
+    """Syncs the slash commands, if they changed. this_server syncs a copy to just this server for testing."""
+    log.info("Running sync command on %s", ctx.guild.name)
+    guild = None
+    if this_server:
+        # Server commands show up straight away, handy for trying out changes
+        bot.tree.copy_global_to(guild=ctx.guild)
+        guild = ctx.guild
+    commands_synced = await command_sync.sync(guild, force)
+    if commands_synced is None:
+        await ctx.send(':white_check_mark: My commands are already up to date, nothing to sync. Use `force` to sync anyway.')
+        return
     await ctx.send(':white_check_mark: My commands have been synced successfully *beep boop*. If you don\'t see any expected changes, try restarting the Discord app.')
 
 @sync.error
@@ -38,19 +117,167 @@ async def sync_error(ctx, error):
     else:
         await ctx.reply('Something went wrong. Vague, I know.')
 
+@bot.hybrid_command()
+async def reload_config(ctx):
+    """Reloads config.json now, keeping every lock and countdown."""
+    if ctx.author.id != config_manager.config.owner:
+        await ctx.send(":exclamation: You are not my master, you have no control over me!")
+        return
+    try:
+        config_manager.reload()
+    except (OSError, ValueError) as e:
+        await ctx.send(f":warning: config.json wasn't reloaded, I'm still using the last good one: {e}")
+        return
+    await ctx.send(":white_check_mark: Reloaded config.json. Settings that only matter at startup, like the token or sharding, still need a restart.")
+
 @bot.hybrid_command()
 async def restart(ctx):
     """Restarts the bot."""
-    if ctx.author.id == config['owner']:
+    if ctx.author.id == config_manager.config.owner:
         await bot.reload_extension("channel_management")
         await ctx.send(':white_check_mark: I have restarted successfully *beep boop*.')
     else:
         await ctx.send(":exclamation: You are not my master, you have no control over me!")
 
+@bot.hybrid_group()
+async def debug(ctx):
+    """Owner-only diagnostics."""
+    if ctx.invoked_subcommand is None:
+        await ctx.send("Try `/debug memory`, `/debug profile`, `/debug tracemalloc` or `/debug watchdog`.")
+
+@debug.command(name="memory")
+async def debug_memory(ctx):
+    """Shows how much the bot is holding in memory."""
+    if ctx.author.id != config_manager.config.owner:
+        await ctx.send(":exclamation: You are not my master, you have no control over me!")
+        return
+    embed = discord.Embed(title="Memory", color=discord.Color.blue())
+    # ru_maxrss is in kilobytes on Linux, and the peak rather than the current size
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    embed.add_field(name="Process", value=f"Peak RSS: {peak_rss:.1f} MB", inline=False)
+    embed.add_field(name="discord.py cache", value=f"Messages: {len(bot.cached_messages)}\nUsers: {len(bot.users)}\nServers: {len(bot.guilds)}", inline=False)
+    if bot.message_filter is not None:
+        embed.add_field(name="Message filter", value=f"Passed: {bot.message_filter.passed}\nDropped: {bot.message_filter.dropped}", inline=False)
+    cog = bot.get_cog('ChannelManagement')
+    if cog is not None:
+        embed.add_field(name="Lock tables", value="\n".join(f"{name.capitalize()}: {size}" for name, size in cog.memory_report().items()), inline=False)
+    await ctx.send(embed=embed, ephemeral=True)
+
+@bot.hybrid_command()
+async def stats(ctx):
+    """Shows what the bot has been doing since it started."""
+    if ctx.author.id != config_manager.config.owner:
+        await ctx.send(":exclamation: You are not my master, you have no control over me!")
+        return
+    metrics = bot.metrics
+    embed = discord.Embed(title="Stats", color=discord.Color.blue())
+    for name, title in (("turo_pings_total", "Pings"), ("turo_locks_total", "Locks"), ("turo_unlocks_total", "Unlocks"),
+                        ("turo_interrupts_total", "Interrupts"), ("turo_skips_total", "Skipped pings")):
+        counts = metrics.counter_values(name)
+        if counts:
+            lines = [f"{', '.join(str(value) for _, value in labels) or 'all'}: {count}" for labels, count in sorted(counts.items())]
+            embed.add_field(name=f"{title} ({sum(counts.values())})", value="\n".join(lines), inline=True)
+    for name, title in (("turo_lock_delay_seconds", "Lock delay"), ("turo_lock_stage_seconds", "Lock stages"), ("turo_rest_request_seconds", "REST latency")):
+        histograms = metrics.histogram_values(name)
+        if histograms:
+            lines = [
+                f"{', '.join(str(value) for _, value in labels) or 'all'}: " + " / ".join(f"p{p} {histogram.percentile(p) * 1000:.0f} ms" for p in (50, 90, 99))
+                for labels, histogram in sorted(histograms.items())
+            ]
+            embed.add_field(name=title, value="\n".join(lines), inline=False)
+    if not embed.fields:
+        embed.description = "Nothing has happened yet."
+    await ctx.send(embed=embed, ephemeral=True)
+
+# Profiles, allocation diffs and watchdog reports are written here
+profile_dir = config.get('profile_dir', os.path.join(base_dir, 'profiles'))
+memory_snapshots = MemorySnapshots()
+watchdog = None
+profiling = False
+
+def summary_block(summary):
+    # Discord messages top out at 2000 characters
+    return f"```\n{summary[:1800]}\n```"
+
+@debug.command(name="profile")
+async def debug_profile(ctx, seconds: int = 10, mode: str = "sample"):
+    """Profiles the event loop for a number of seconds, mode is 'sample' or 'cprofile'."""
+    global profiling
+    if ctx.author.id != config_manager.config.owner:
+        await ctx.send(":exclamation: You are not my master, you have no control over me!")
+        return
+    if profiling:
+        await ctx.send("A profile is already running.", ephemeral=True)
+        return
+    if mode not in ("sample", "cprofile") or not 1 <= seconds <= 300:
+        await ctx.send("Use `sample` or `cprofile` for between 1 and 300 seconds.", ephemeral=True)
+        return
+    await ctx.defer(ephemeral=True)
+    profiling = True
+    try:
+        # Sampling barely slows the bot down, cProfile sees every call but adds overhead to all of them
+        profile = sample_for if mode == "sample" else cprofile_for
+        path, summary = await profile(seconds, profile_dir)
+    finally:
+        profiling = False
+    log.info("Wrote %s profile to %s", mode, path)
+    await ctx.send(f"Profiled for {seconds} seconds, saved to `{path}`.\n{summary_block(summary)}", ephemeral=True)
+
+@debug.command(name="tracemalloc")
+async def debug_tracemalloc(ctx, stop: bool = False):
+    """Snapshots memory allocations and shows what grew since the last snapshot."""
+    if ctx.author.id != config_manager.config.owner:
+        await ctx.send(":exclamation: You are not my master, you have no control over me!")
+        return
+    if stop:
+        memory_snapshots.stop()
+        await ctx.send("Stopped tracing allocations.", ephemeral=True)
+        return
+    await ctx.defer(ephemeral=True)
+    path, summary = await memory_snapshots.take(profile_dir)
+    message = summary_block(summary) if path is None else f"Saved the full diff to `{path}`.\n{summary_block(summary)}"
+    await ctx.send(message, ephemeral=True)
+
+@debug.command(name="watchdog")
+async def debug_watchdog(ctx, threshold_ms: int = 100):
+    """Starts or stops reporting anything that blocks the event loop for longer than threshold_ms."""
+    global watchdog
+    if ctx.author.id != config_manager.config.owner:
+        await ctx.send(":exclamation: You are not my master, you have no control over me!")
+        return
+    if watchdog is None:
+        watchdog = LoopWatchdog(asyncio.get_running_loop(), threshold_ms / 1000, os.path.join(profile_dir, 'slow-callbacks.txt'))
+        watchdog.start()
+        await ctx.send(f"Watching for callbacks that block the loop for more than {threshold_ms} ms, run this again to stop.", ephemeral=True)
+        return
+    stopped, watchdog = watchdog, None
+    await asyncio.to_thread(stopped.stop)
+    if not stopped.incidents:
+        await ctx.send("Stopped watching, nothing blocked the loop.", ephemeral=True)
+        return
+    worst = max(stopped.incidents, key=lambda incident: incident[1])
+    # The innermost frames are the ones doing the blocking
+    stack = "".join(worst[2].splitlines(keepends=True)[-12:])
+    await ctx.send(
+        f"Stopped watching. The loop was blocked {len(stopped.incidents)} time(s), the worst for {worst[1] * 1000:.0f} ms. "
+        f"Every stack is in `{stopped.path}`.\n{summary_block(stack)}",
+        ephemeral=True
+    )
+
 async def main():
     async with bot:
-        await bot.load_extension("channel_management")
-        await bot.start(config['token'])
+        metrics_server = None
+        if config.get('metrics_port'):
+            # Prometheus text on http://127.0.0.1:<port>/metrics, only reachable from this machine unless metrics_host says otherwise
+            metrics_server = await bot.metrics.serve(config.get('metrics_host', '127.0.0.1'), config['metrics_port'])
+        try:
+            await bot.load_extension("channel_management")
+            await bot.start(config['token'])
+        finally:
+            config_manager.stop()
+            if metrics_server is not None:
+                metrics_server.close()
+            log_listener.stop()
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
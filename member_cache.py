@@ -0,0 +1,91 @@
+import time
+from collections import OrderedDict
+
+import discord
+
+FULL = 'full'
+LEAN = 'lean'
+
+def bot_options(policy, intents):
+    """Client options for a member cache policy.
+
+    'full' keeps discord.py's default of chunking and caching every member of
+    every server. 'lean' turns the members intent off and caches nothing at
+    startup, MemberCache then keeps just the members the bot actually needs.
+    """
+    if policy == LEAN:
+        intents.members = False
+        return {
+            'intents': intents,
+            'member_cache_flags': discord.MemberCacheFlags.none(),
+            'chunk_guilds_at_startup': False,
+        }
+    intents.members = True
+    return {'intents': intents}
+
+class MemberCache:
+    """The Pokétwo member for each server plus a small LRU of hunters.
+
+    Lookups try discord.py's own cache first, so this costs nothing with the
+    full policy and only starts holding members when the lean one is used.
+    """
+
+    def __init__(self, poketwo_bot_id, max_hunters=5000, hunter_ttl=600):
+        self.poketwo_bot_id = poketwo_bot_id
+        self.max_hunters = max_hunters
+        self.hunter_ttl = hunter_ttl  # Roles change, so don't trust a cached hunter forever
+        self.poketwo = {}  # server ID -> Pokétwo member
+        self.hunters = OrderedDict()  # (server ID, user ID) -> (member, cached at)
+
+    def __len__(self):
+        return len(self.poketwo) + len(self.hunters)
+
+    def remember_poketwo(self, member):
+        # Only the ID matters for overwrites, so any Member object for Pokétwo is good enough to keep
+        if isinstance(member, discord.Member):
+            self.poketwo[member.guild.id] = member
+
+    async def poketwo_member(self, guild):
+        member = guild.get_member(self.poketwo_bot_id) or self.poketwo.get(guild.id)
+        if member is None:
+            try:
+                member = await guild.fetch_member(self.poketwo_bot_id)
+            except (discord.NotFound, discord.Forbidden):
+                return None
+        self.poketwo[guild.id] = member
+        return member
+
+    def remember_hunter(self, member):
+        key = (member.guild.id, member.id)
+        self.hunters[key] = (member, time.monotonic())
+        self.hunters.move_to_end(key)
+        while len(self.hunters) > self.max_hunters:
+            self.hunters.popitem(last=False)
+
+    async def hunter(self, guild, user_id, mentioned=None):
+        """Resolves a mentioned hunter, preferring the member data sent with the message.
+
+        mentioned maps user IDs to the members from message.mentions.
+        """
+        member = mentioned.get(user_id) if mentioned else None
+        if isinstance(member, discord.Member):
+            return member
+        member = guild.get_member(user_id)
+        if member is not None:
+            return member
+        key = (guild.id, user_id)
+        cached = self.hunters.get(key)
+        if cached is not None and time.monotonic() - cached[1] < self.hunter_ttl:
+            self.hunters.move_to_end(key)
+            return cached[0]
+        try:
+            member = await guild.fetch_member(user_id)
+        except (discord.NotFound, discord.Forbidden):
+            return None
+        self.remember_hunter(member)
+        return member
+
+    def forget_guild(self, guild_id):
+        self.poketwo.pop(guild_id, None)
+        for key in [key for key in self.hunters if key[0] == guild_id]:
+            del self.hunters[key]
@@ -0,0 +1,90 @@
+import asyncio
+from latency import BUCKETS, LatencyHistogram
+
+def label_text(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{value}"' for name, value in labels) + '}'
+
+class Metrics:
+    """Counters and histograms keyed by name and labels, readable by /stats and Prometheus.
+
+    Updating one is a dict lookup and an addition, so they can sit on the
+    hot path. Histograms reuse the fixed buckets from latency.py.
+    """
+
+    def __init__(self):
+        self.counters = {}  # (name, labels) -> count
+        self.histograms = {}  # (name, labels) -> LatencyHistogram
+        self.descriptions = {}
+
+    def describe(self, name, text):
+        self.descriptions[name] = text
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    def observe(self, name, seconds, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self.histograms.get(key)
+        if histogram is None:
+            histogram = self.histograms[key] = LatencyHistogram()
+        histogram.record(seconds)
+
+    def counter_values(self, name):
+        """{labels: count} for one counter."""
+        return {labels: count for (counter, labels), count in self.counters.items() if counter == name}
+
+    def histogram_values(self, name):
+        """{labels: LatencyHistogram} for one histogram."""
+        return {labels: histogram for (key, labels), histogram in self.histograms.items() if key == name}
+
+    def render(self):
+        """Everything in the Prometheus text exposition format."""
+        lines = []
+        for name in sorted({name for name, _ in self.counters}):
+            if name in self.descriptions:
+                lines.append(f'# HELP {name} {self.descriptions[name]}')
+            lines.append(f'# TYPE {name} counter')
+            for labels, count in sorted(self.counter_values(name).items()):
+                lines.append(f'{name}{label_text(labels)} {count}')
+        for name in sorted({name for name, _ in self.histograms}):
+            if name in self.descriptions:
+                lines.append(f'# HELP {name} {self.descriptions[name]}')
+            lines.append(f'# TYPE {name} histogram')
+            for labels, histogram in sorted(self.histogram_values(name).items()):
+                cumulative = 0
+                for bound, count in zip(BUCKETS, histogram.counts):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{label_text(labels + (("le", repr(bound)),))} {cumulative}')
+                lines.append(f'{name}_bucket{label_text(labels + (("le", "+Inf"),))} {histogram.count}')
+                lines.append(f'{name}_sum{label_text(labels)} {histogram.total}')
+                lines.append(f'{name}_count{label_text(labels)} {histogram.count}')
+        return '\n'.join(lines) + '\n'
+
+    async def serve(self, host='127.0.0.1', port=9108):
+        """Serves /metrics over plain HTTP on the bot's own loop. Returns the asyncio server."""
+
+        async def handle(reader, writer):
+            try:
+                request = await asyncio.wait_for(reader.readline(), 5)
+                # Nothing in the headers matters, but they have to be read before answering
+                while (await asyncio.wait_for(reader.readline(), 5)).strip():
+                    pass
+                parts = request.decode('latin-1').split()
+                if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+                    status, body = '200 OK', self.render().encode()
+                else:
+                    status, body = '404 Not Found', b'Not found\n'
+                writer.write(
+                    f'HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode()
+                    + body
+                )
+                await writer.drain()
+            except (asyncio.TimeoutError, ConnectionError):
+                pass
+            finally:
+                writer.close()
+
+        return await asyncio.start_server(handle, host, port)
@@ -0,0 +1,107 @@
+import re
+
+# Ping types in order of priority, with the phrases helper bots use for them
+DEFAULT_KEYWORDS = {
+    'shiny': ["shiny hunt pings"],
+    'collection': ["collection pings"],
+    'rare': ["rare ping"],
+    'regional': ["regional ping"],
+}
+
+MENTION_PATTERN = re.compile(r'<@!?(\d+)>')
+
+def common_anchor(phrases):
+    # Longest substring shared by every phrase, so a single str.find can locate all of them
+    shortest = min(phrases, key=len)
+    for length in range(len(shortest), 1, -1):
+        for start in range(len(shortest) - length + 1):
+            candidate = shortest[start:start + length]
+            if all(candidate in phrase for phrase in phrases):
+                return candidate
+    return None
+
+class PingClassifier:
+    """Finds the highest priority ping in a message in a single pass.
+
+    Everything that depends on the keywords is worked out here, once, so classify
+    only has to scan the message.
+    """
+
+    def __init__(self, keywords=None):
+        keywords = keywords or DEFAULT_KEYWORDS
+        self.ping_types = list(keywords)
+        self.priority = {}
+        for ping_type, group in keywords.items():
+            for phrase in group:
+                self.priority.setdefault(phrase.lower(), (self.ping_types.index(ping_type), ping_type))
+
+        # Longest phrases first so a phrase never shadows a longer one it prefixes
+        phrases = sorted(self.priority, key=len, reverse=True)
+        self.pattern = re.compile('|'.join(map(re.escape, phrases))) if phrases else None
+        self.anchor = common_anchor(phrases) if phrases else None
+        self.anchored = []
+        if self.anchor:
+            # (offset of the anchor inside the phrase, phrase, rank, ping type) for every occurrence
+            for phrase in phrases:
+                offset = phrase.find(self.anchor)
+                while offset != -1:
+                    self.anchored.append((offset, phrase) + self.priority[phrase])
+                    offset = phrase.find(self.anchor, offset + 1)
+
+    def matches(self, lowered):
+        """Yields (start, end, rank, ping_type) for keyword hits, in message order."""
+        if not self.anchor:
+            for match in self.pattern.finditer(lowered):
+                yield (match.start(), match.end()) + self.priority[match.group()]
+            return
+        anchor = self.anchor
+        position = lowered.find(anchor)
+        while position != -1:
+            for offset, phrase, rank, ping_type in self.anchored:
+                start = position - offset
+                if start >= 0 and lowered.startswith(phrase, start):
+                    yield start, start + len(phrase), rank, ping_type
+                    break
+            position = lowered.find(anchor, position + 1)
+
+    def classify(self, content):
+        """Returns (ping_type, mention_ids) for the best ping line, or None if nothing matched.
+
+        A line only counts as a ping if it also contains an @, the same as before.
+        """
+        if self.pattern is None or '@' not in content:
+            return None
+        lowered = content.lower()
+        best = None
+        for start, end, rank, ping_type in self.matches(lowered):
+            if best is not None and rank >= best[0]:
+                continue
+            line_start = lowered.rfind('\n', 0, start) + 1
+            line_end = lowered.find('\n', end)
+            if line_end == -1:
+                line_end = len(lowered)
+            if lowered.find('@', line_start, line_end) == -1:
+                continue
+            best = (rank, ping_type, line_start, line_end)
+            if rank == 0:
+                break
+        if best is None:
+            return None
+        _, ping_type, line_start, line_end = best
+        mention_ids = [int(user_id) for user_id in MENTION_PATTERN.findall(lowered, line_start, line_end)]
+        return ping_type, mention_ids
+
+def build_classifier(overrides=None):
+    """Builds a classifier from the defaults plus any per-server keyword overrides.
+
+    Overrides map a ping type to extra phrases, e.g. {"rare": ["legendary ping"]}.
+    """
+    if not overrides:
+        return default_classifier
+    keywords = {ping_type: list(phrases) for ping_type, phrases in DEFAULT_KEYWORDS.items()}
+    for ping_type, phrases in overrides.items():
+        if ping_type in keywords:
+            keywords[ping_type].extend(phrases)
+    return PingClassifier(keywords)
+
+default_classifier = PingClassifier()
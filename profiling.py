@@ -0,0 +1,156 @@
+import asyncio, collections, cProfile, io, os, pstats, sys, threading, time, tracemalloc, traceback
+
+def timestamped(directory, name, extension):
+    os.makedirs(directory, exist_ok=True)
+    return os.path.join(directory, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}.{extension}")
+
+async def cprofile_for(seconds, directory, top=15):
+    """Runs cProfile on the event loop thread for a while. Returns (stats file, summary)."""
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        await asyncio.sleep(seconds)
+    finally:
+        profile.disable()
+    path = timestamped(directory, 'cprofile', 'pstats')
+
+    def write():
+        # Sorting and dumping a big profile takes a while, so it happens off the loop
+        profile.dump_stats(path)
+        output = io.StringIO()
+        pstats.Stats(profile, stream=output).strip_dirs().sort_stats('cumulative').print_stats(top)
+        return output.getvalue()
+
+    return path, await asyncio.to_thread(write)
+
+def frame_name(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+def sample_stacks(thread_id, seconds, interval):
+    """Counts the stacks a thread is in, looking every interval seconds. Runs in its own thread."""
+    stacks = collections.Counter()
+    deadline = time.monotonic() + seconds
+    while time.monotonic() < deadline:
+        frame = sys._current_frames().get(thread_id)
+        stack = []
+        while frame is not None:
+            stack.append(frame_name(frame))
+            frame = frame.f_back
+        if stack:
+            stacks[tuple(reversed(stack))] += 1
+        time.sleep(interval)
+    return stacks
+
+async def sample_for(seconds, directory, interval=0.005, top=15):
+    """Samples the event loop thread's stack, much cheaper than cProfile. Returns (collapsed stacks file, summary).
+
+    The file is in the collapsed format flamegraph.pl and speedscope read.
+    """
+    stacks = await asyncio.to_thread(sample_stacks, threading.get_ident(), seconds, interval)
+    path = timestamped(directory, 'samples', 'txt')
+    total = sum(stacks.values()) or 1
+    leaves = collections.Counter()
+    for stack, count in stacks.items():
+        leaves[stack[-1]] += count
+
+    def write():
+        with open(path, 'w') as f:
+            for stack, count in stacks.most_common():
+                f.write(f"{';'.join(stack)} {count}\n")
+
+    await asyncio.to_thread(write)
+    # The loop waiting in select() is idle time, anything else is the loop doing work
+    lines = [f"{total} samples"] + [f"{count / total:6.1%}  {name}" for name, count in leaves.most_common(top)]
+    return path, "\n".join(lines)
+
+class MemorySnapshots:
+    """tracemalloc snapshots, each one compared with the one before."""
+
+    def __init__(self, frames=10):
+        self.frames = frames
+        self.previous = None
+
+    async def take(self, directory, top=15):
+        """Returns (diff file, summary). The first call only starts tracing."""
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            self.previous = tracemalloc.take_snapshot()
+            return None, "Started tracing allocations, take another snapshot later to see what changed."
+        snapshot = tracemalloc.take_snapshot()
+        previous, self.previous = self.previous, snapshot
+        path = timestamped(directory, 'tracemalloc', 'txt')
+
+        def write():
+            differences = snapshot.compare_to(previous, 'traceback')
+            with open(path, 'w') as f:
+                for difference in differences[:100]:
+                    f.write(f"{difference}\n")
+                    for line in difference.traceback.format():
+                        f.write(f"    {line}\n")
+            current, peak = tracemalloc.get_traced_memory()
+            lines = [f"Traced: {current / 1024 / 1024:.1f} MB now, {peak / 1024 / 1024:.1f} MB peak"]
+            lines += [str(difference) for difference in snapshot.compare_to(previous, 'lineno')[:top]]
+            return "\n".join(lines)
+
+        return path, await asyncio.to_thread(write)
+
+    def stop(self):
+        tracemalloc.stop()
+        self.previous = None
+
+class LoopWatchdog:
+    """Catches callbacks that hold the event loop for longer than threshold seconds, with the stack they were in.
+
+    A thread keeps asking the loop to run a tiny callback. If the loop doesn't
+    get to it within the threshold, whatever is running on the loop thread at
+    that moment is what's blocking it.
+    """
+
+    def __init__(self, loop, threshold, path, keep=50):
+        self.loop = loop
+        self.threshold = threshold
+        self.path = path
+        self.incidents = collections.deque(maxlen=keep)  # (wall clock time, seconds blocked, stack)
+        self._beat = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+        self._loop_thread_id = None
+
+    def start(self):
+        # Called from the loop, so this is the thread to watch
+        self._loop_thread_id = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name='loop-watchdog', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _tick(self):
+        self._beat = time.monotonic()
+
+    def _watch(self):
+        sent = time.monotonic()
+        self.loop.call_soon_threadsafe(self._tick)
+        stack = None
+        while not self._stop.wait(self.threshold / 4):
+            if self._beat >= sent:
+                if stack is not None:
+                    self._record(self._beat - sent, stack)
+                    stack = None
+                sent = time.monotonic()
+                self.loop.call_soon_threadsafe(self._tick)
+            elif stack is None and time.monotonic() - sent > self.threshold:
+                # Still blocked, grab the stack while the culprit is running
+                frame = sys._current_frames().get(self._loop_thread_id)
+                stack = ''.join(traceback.format_stack(frame)) if frame is not None else '(no stack)'
+
+    def _record(self, blocked, stack):
+        self.incidents.append((time.time(), blocked, stack))
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, 'a') as f:
+            f.write(f"{time.strftime('%Y-%m-%d %H:%M:%S')} loop blocked for {blocked * 1000:.0f} ms\n{stack}\n")
@@ -0,0 +1,281 @@
+import asyncio, heapq, itertools, time
+
+# Priorities, lowest goes first: stopping the spawn from fleeing beats letting it back in beats chat messages,
+# and maintenance like permission syncs waits for everything else
+LOCK = 0
+UNLOCK = 1
+NOTIFY = 2
+BULK = 3
+
+PRIORITY_NAMES = {LOCK: 'lock', UNLOCK: 'unlock', NOTIFY: 'notify', BULK: 'bulk'}
+
+# (requests, per seconds) we allow ourselves for each kind of bucket, Discord's headers win once we hit a 429
+DEFAULT_BUCKET_LIMITS = {
+    'permissions': (10, 10.0),
+    'messages': (5, 5.0),
+    'channels': (2, 10.0),
+}
+
+def rate_limit_retry_after(error):
+    """Returns how long to back off if the error is a 429, otherwise None."""
+    retry_after = getattr(error, 'retry_after', None)  # discord.RateLimited
+    if retry_after is not None:
+        return float(retry_after)
+    if getattr(error, 'status', None) == 429:
+        response = getattr(error, 'response', None)
+        headers = getattr(response, 'headers', None) or {}
+        try:
+            return float(headers.get('Retry-After', 1.0))
+        except (TypeError, ValueError):
+            return 1.0
+    return None
+
+class Job:
+    __slots__ = ('priority', 'bucket', 'operation', 'key', 'future', 'queued_at', 'attempts', 'superseded')
+
+    def __init__(self, priority, bucket, operation, key, future):
+        self.priority = priority
+        self.bucket = bucket
+        self.operation = operation
+        self.key = key
+        self.future = future
+        self.queued_at = time.monotonic()
+        self.attempts = 0
+        self.superseded = False
+
+class Bucket:
+    __slots__ = ('limit', 'per', 'remaining', 'reset_at', 'parked')
+
+    def __init__(self, limit, per):
+        self.limit = limit
+        self.per = per
+        self.remaining = limit
+        self.reset_at = 0.0
+        self.parked = []  # jobs waiting for this bucket to reset
+
+    def take(self, now):
+        if now >= self.reset_at:
+            self.remaining = self.limit
+            self.reset_at = now + self.per
+        if self.remaining > 0:
+            self.remaining -= 1
+            return True
+        return False
+
+class RestDispatcher:
+    """Prioritised queue for the REST calls behind locking and unlocking.
+
+    Operations are zero argument coroutine functions tagged with a priority, a
+    rate limit bucket such as ('permissions', channel_id) and optionally a
+    coalesce key. Queuing a job with the same key as one that hasn't started
+    yet replaces it, and whoever was waiting on the old one gets the new
+    result. Each bucket has its own budget; a bucket that is out of budget or
+    got a 429 parks its jobs until it resets, without holding up other buckets.
+
+    discord.py can sleep inside a call for a long rate limit, so on top of
+    the shared workers a few reserved ones only ever run LOCK and UNLOCK
+    jobs. Slow messages can't leave a lock with nobody to run it.
+    """
+
+    def __init__(self, workers=4, bucket_limits=None, max_attempts=5, max_buckets=10_000, metrics=None, reserved_workers=2):
+        self.bucket_limits = {**DEFAULT_BUCKET_LIMITS, **(bucket_limits or {})}
+        self.max_attempts = max_attempts
+        self.max_buckets = max_buckets  # Idle buckets past this many are dropped, there's one per channel touched
+        self.worker_count = workers
+        self.reserved_workers = reserved_workers
+        self.metrics = metrics  # Optional Metrics registry for request latency and outcomes
+        self._queue = []
+        self._sequence = itertools.count()
+        self._pending = {}  # coalesce key -> queued job
+        self._buckets = {}
+        self._ready = asyncio.Event()
+        self._workers = []
+        self._timers = {}  # bucket name -> pending release timer
+        self.queued = 0  # jobs waiting to run, parked ones included
+        self.stats = {
+            'completed': 0,
+            'failed': 0,
+            'coalesced': 0,
+            'rate_limited': 0,
+            'waits': {name: {'count': 0, 'total': 0.0, 'max': 0.0} for name in PRIORITY_NAMES.values()},
+        }
+
+    def start(self):
+        if not self._workers:
+            loop = asyncio.get_running_loop()
+            self._workers = [loop.create_task(self._work()) for _ in range(self.worker_count)]
+            self._workers += [loop.create_task(self._work(UNLOCK)) for _ in range(self.reserved_workers)]
+
+    async def stop(self):
+        for timer in self._timers.values():
+            timer.cancel()
+        self._timers.clear()
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        # Nothing will run what's left, so let whoever is waiting on it go
+        waiting = [job for _, _, job in self._queue]
+        for bucket in self._buckets.values():
+            waiting += bucket.parked
+            bucket.parked = []
+        for job in waiting:
+            if not job.future.done():
+                job.future.cancel()
+        self._queue.clear()
+        self._pending.clear()
+        self.queued = 0
+
+    def submit(self, priority, bucket, operation, key=None):
+        """Queues an operation and returns a future for its result."""
+        future = asyncio.get_running_loop().create_future()
+        job = Job(priority, bucket, operation, key, future)
+        if key is not None:
+            previous = self._pending.get(key)
+            if previous is not None and not previous.superseded:
+                previous.superseded = True
+                self.queued -= 1
+                self.stats['coalesced'] += 1
+                future.add_done_callback(lambda done, waiting=previous.future: self._forward(done, waiting))
+            self._pending[key] = job
+        self.queued += 1
+        self._push(job)
+        return future
+
+    async def run(self, priority, bucket, operation, key=None):
+        return await self.submit(priority, bucket, operation, key)
+
+    @property
+    def depth(self):
+        return self.queued
+
+    def summary(self):
+        waits = {
+            name: {
+                'count': wait['count'],
+                'mean': wait['total'] / wait['count'] if wait['count'] else 0.0,
+                'max': wait['max'],
+            }
+            for name, wait in self.stats['waits'].items()
+        }
+        return {
+            'depth': self.depth,
+            'completed': self.stats['completed'],
+            'failed': self.stats['failed'],
+            'coalesced': self.stats['coalesced'],
+            'rate_limited': self.stats['rate_limited'],
+            'waits': waits,
+        }
+
+    @staticmethod
+    def _forward(done, waiting):
+        if waiting.done():
+            return
+        if done.cancelled():
+            waiting.cancel()
+        elif done.exception() is not None:
+            waiting.set_exception(done.exception())
+        else:
+            waiting.set_result(done.result())
+
+    def _push(self, job):
+        heapq.heappush(self._queue, (job.priority, next(self._sequence), job))
+        self._ready.set()
+
+    def _bucket(self, name):
+        bucket = self._buckets.get(name)
+        if bucket is None:
+            kind = name[0] if isinstance(name, tuple) else name
+            if len(self._buckets) >= self.max_buckets:
+                self._prune_buckets()
+            bucket = self._buckets[name] = Bucket(*self.bucket_limits.get(kind, (5, 5.0)))
+        return bucket
+
+    def _prune_buckets(self):
+        # A bucket whose window has passed starts over with a full budget anyway, so forgetting it changes nothing
+        now = time.monotonic()
+        idle = [name for name, bucket in self._buckets.items() if bucket.reset_at <= now and not bucket.parked and name not in self._timers]
+        for name in idle:
+            del self._buckets[name]
+
+    def _park(self, job, bucket, name):
+        bucket.parked.append(job)
+        if name not in self._timers:
+            delay = max(bucket.reset_at - time.monotonic(), 0.0)
+            self._timers[name] = asyncio.get_running_loop().call_later(delay, self._release, name)
+
+    def _release(self, name):
+        bucket = self._buckets[name]
+        if bucket.reset_at > time.monotonic():
+            # A 429 pushed the reset back while we were waiting
+            self._timers[name] = asyncio.get_running_loop().call_later(bucket.reset_at - time.monotonic(), self._release, name)
+            return
+        del self._timers[name]
+        parked, bucket.parked = bucket.parked, []
+        for job in parked:
+            self._push(job)
+
+    async def _next_job(self, max_priority=None):
+        while True:
+            while self._queue:
+                priority, _, job = self._queue[0]
+                if max_priority is not None and priority > max_priority and not job.superseded:
+                    break  # The queue is in priority order, so nothing urgent is waiting
+                heapq.heappop(self._queue)
+                if job.superseded:
+                    continue
+                bucket = self._bucket(job.bucket)
+                if bucket.parked or not bucket.take(time.monotonic()):
+                    self._park(job, bucket, job.bucket)
+                    continue
+                self.queued -= 1
+                if job.key is not None and self._pending.get(job.key) is job:
+                    del self._pending[job.key]
+                return job
+            self._ready.clear()
+            await self._ready.wait()
+
+    async def _work(self, max_priority=None):
+        while True:
+            job = await self._next_job(max_priority)
+            if job.attempts == 0:
+                waited = time.monotonic() - job.queued_at
+                wait = self.stats['waits'][PRIORITY_NAMES.get(job.priority, 'notify')]
+                wait['count'] += 1
+                wait['total'] += waited
+                wait['max'] = max(wait['max'], waited)
+            job.attempts += 1
+            kind = job.bucket[0] if isinstance(job.bucket, tuple) else job.bucket
+            started = time.monotonic()
+            try:
+                result = await job.operation()
+            except asyncio.CancelledError:
+                if not job.future.done():
+                    job.future.cancel()
+                raise
+            except Exception as e:
+                retry_after = rate_limit_retry_after(e)
+                self._record(kind, started, 'rate_limited' if retry_after is not None else 'failed')
+                if retry_after is not None and job.attempts < self.max_attempts:
+                    self.stats['rate_limited'] += 1
+                    bucket = self._bucket(job.bucket)
+                    # Respect what Discord told us, doubling up if it keeps happening
+                    bucket.remaining = 0
+                    bucket.reset_at = max(bucket.reset_at, time.monotonic() + retry_after * (2 ** (job.attempts - 1)))
+                    self.queued += 1
+                    self._ready.set()
+                    self._park(job, bucket, job.bucket)
+                    continue
+                self.stats['failed'] += 1
+                if not job.future.done():
+                    job.future.set_exception(e)
+                continue
+            self._record(kind, started, 'ok')
+            self.stats['completed'] += 1
+            if not job.future.done():
+                job.future.set_result(result)
+
+    def _record(self, kind, started, outcome):
+        if self.metrics is not None:
+            self.metrics.observe('turo_rest_request_seconds', time.monotonic() - started, kind=kind)
+            self.metrics.inc('turo_rest_requests_total', kind=kind, outcome=outcome)
@@ -0,0 +1,201 @@
+import asyncio, json, logging, sqlite3, time
+from concurrent.futures import ThreadPoolExecutor
+from ttl_table import TTLTable
+
+# How long ping cooldowns are kept around in the database, well past the 60 second cooldown itself
+COOLDOWN_RETENTION = 3600
+
+log = logging.getLogger('turo.settings')
+
+class SettingsStore:
+    """Per-server settings, active locks and ping cooldowns kept in memory and written behind to SQLite.
+
+    Reads never touch the disk. Writes mark the server as dirty and a single
+    background flush, run on a dedicated writer thread, commits every dirty
+    server in one transaction, so a crash leaves either the old or the new
+    settings but never a half written file.
+
+    Several bot processes can share one database file. Every server belongs
+    to exactly one shard, so each process only ever writes rows for its own
+    servers and a flush never overwrites another process's changes.
+    """
+
+    def __init__(self, path, legacy_server_configs=None, flush_delay=1.0, cooldown_ttl=60, max_cooldowns=100_000):
+        self.path = path
+        self.flush_delay = flush_delay
+        self.server_configs = {}
+        self.locks = {}  # channel ID -> (guild ID, lock message ID, unlock time or None), as loaded at startup
+        self._dirty = set()
+        self._dirty_locks = {}  # channel ID -> row to write, or None to delete it
+        self.cooldowns = TTLTable(cooldown_ttl, max_cooldowns)  # channel ID -> time.time() a ping was last actioned
+        self._dirty_cooldowns = {}
+        self.stats = {}  # lock history aggregate key -> totals, see lock_history.py
+        self._dirty_stats = {}
+        self._flush_task = None
+        # sqlite3 connections belong to the thread that made them, so all disk work goes through one thread
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="settings-writer")
+        self._connection = None
+        self._data_version = None  # SQLite bumps this when another connection commits
+        self._config_version = 0  # Highest server_configs version seen, every write gets the next one
+        self._executor.submit(self._load, legacy_server_configs or {}).result()
+
+    def _connect(self):
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path, isolation_level=None)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            # Other processes may be committing at the same moment, wait for them rather than failing
+            self._connection.execute("PRAGMA busy_timeout=5000")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS server_configs (guild_id TEXT PRIMARY KEY, data TEXT NOT NULL, version INTEGER NOT NULL DEFAULT 0)")
+            if 'version' not in [column[1] for column in self._connection.execute("PRAGMA table_info(server_configs)")]:
+                self._connection.execute("ALTER TABLE server_configs ADD COLUMN version INTEGER NOT NULL DEFAULT 0")
+            self._connection.execute("CREATE INDEX IF NOT EXISTS server_configs_version ON server_configs (version)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS locks (channel_id INTEGER PRIMARY KEY, guild_id INTEGER NOT NULL, message_id INTEGER, unlock_time REAL)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS cooldowns (channel_id INTEGER PRIMARY KEY, last_actioned REAL NOT NULL)")
+            self._connection.execute("CREATE TABLE IF NOT EXISTS lock_stats (key TEXT PRIMARY KEY, data TEXT NOT NULL)")
+        return self._connection
+
+    def _load(self, legacy_server_configs):
+        connection = self._connect()
+        for channel_id, guild_id, message_id, unlock_time in connection.execute("SELECT channel_id, guild_id, message_id, unlock_time FROM locks"):
+            self.locks[channel_id] = (guild_id, message_id, unlock_time)
+        # Only cooldowns that could still matter are worth bringing back
+        query = "SELECT channel_id, last_actioned FROM cooldowns WHERE last_actioned > ? ORDER BY last_actioned"
+        for channel_id, last_actioned in connection.execute(query, (time.time() - self.cooldowns.ttl,)):
+            self.cooldowns.set(channel_id, last_actioned, last_actioned)
+        for key, data in connection.execute("SELECT key, data FROM lock_stats"):
+            self.stats[key] = json.loads(data)
+        self._data_version = connection.execute("PRAGMA data_version").fetchone()[0]
+        rows = connection.execute("SELECT guild_id, data, version FROM server_configs").fetchall()
+        if rows:
+            self.server_configs = {guild_id: json.loads(data) for guild_id, data, _ in rows}
+            self._config_version = max(version for _, _, version in rows)
+        elif legacy_server_configs:
+            # First run after the move out of config.json, bring the old settings across once
+            self.server_configs = {str(guild_id): dict(data) for guild_id, data in legacy_server_configs.items()}
+            self._write({guild_id: json.dumps(data) for guild_id, data in self.server_configs.items()}, {}, {})
+
+    def _write(self, rows, lock_rows, cooldown_rows, stats_rows=None):
+        connection = self._connect()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            # Versions only go up, and BEGIN IMMEDIATE keeps two processes from handing out the same one
+            connection.executemany(
+                "INSERT OR REPLACE INTO server_configs (guild_id, data, version) VALUES (?, ?, (SELECT COALESCE(MAX(version), 0) + 1 FROM server_configs))",
+                rows.items()
+            )
+            connection.executemany("DELETE FROM locks WHERE channel_id = ?", [(channel_id,) for channel_id, row in lock_rows.items() if row is None])
+            connection.executemany(
+                "INSERT OR REPLACE INTO locks (channel_id, guild_id, message_id, unlock_time) VALUES (?, ?, ?, ?)",
+                [(channel_id,) + row for channel_id, row in lock_rows.items() if row is not None]
+            )
+            if cooldown_rows:
+                connection.executemany("INSERT OR REPLACE INTO cooldowns (channel_id, last_actioned) VALUES (?, ?)", cooldown_rows.items())
+                connection.execute("DELETE FROM cooldowns WHERE last_actioned < ?", (time.time() - COOLDOWN_RETENTION,))
+            if stats_rows:
+                connection.executemany("INSERT OR REPLACE INTO lock_stats (key, data) VALUES (?, ?)", stats_rows.items())
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
+
+    def _read_if_changed(self):
+        # Runs on the writer thread, parsing included, so the loop only compares dicts
+        connection = self._connect()
+        data_version = connection.execute("PRAGMA data_version").fetchone()[0]
+        if data_version == self._data_version:
+            return {}
+        self._data_version = data_version
+        # Most commits are cooldowns, locks and stats, which leave server_configs alone
+        rows = connection.execute("SELECT guild_id, data, version FROM server_configs WHERE version > ?", (self._config_version,)).fetchall()
+        if rows:
+            self._config_version = max(version for _, _, version in rows)
+        return {guild_id: json.loads(data) for guild_id, data, _ in rows}
+
+    async def refresh(self):
+        """Picks up server settings another process committed. Returns the IDs of servers whose settings changed."""
+        rows = await asyncio.get_running_loop().run_in_executor(self._executor, self._read_if_changed)
+        changed = []
+        for guild_id, server_config in rows.items():
+            if guild_id in self._dirty:
+                continue  # Our own unsaved change is newer
+            if self.server_configs.get(guild_id) != server_config:
+                self.server_configs[guild_id] = server_config
+                changed.append(guild_id)
+        return changed
+
+    def get(self, guild_id):
+        return self.server_configs.get(str(guild_id), {})
+
+    def set(self, guild_id, server_config):
+        guild_id = str(guild_id)
+        self.server_configs[guild_id] = server_config
+        self._dirty.add(guild_id)
+        self._schedule_flush()
+
+    def take_locks(self):
+        """Hands over the locks loaded at startup; after that the cog's own records are the live copy."""
+        locks, self.locks = self.locks, {}
+        return locks
+
+    def save_lock(self, channel_id, guild_id, message_id, unlock_time):
+        self._dirty_locks[channel_id] = (guild_id, message_id, unlock_time)
+        self._schedule_flush()
+
+    def delete_lock(self, channel_id):
+        self.locks.pop(channel_id, None)
+        self._dirty_locks[channel_id] = None
+        self._schedule_flush()
+
+    def set_cooldown(self, channel_id, last_actioned):
+        self.cooldowns.set(channel_id, last_actioned, last_actioned)
+        self._dirty_cooldowns[channel_id] = last_actioned
+        self._schedule_flush()
+
+    def save_stats(self, key, data):
+        self.stats[key] = data
+        self._dirty_stats[key] = json.dumps(data)
+        self._schedule_flush()
+
+    def _has_dirty(self):
+        return bool(self._dirty or self._dirty_locks or self._dirty_cooldowns or self._dirty_stats)
+
+    def _schedule_flush(self):
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self):
+        # Give other admins a moment so a burst of /set_ commands lands in one transaction
+        while self._has_dirty():
+            await asyncio.sleep(self.flush_delay)
+            await self.flush()
+
+    async def flush(self):
+        if not self._has_dirty():
+            return
+        rows = {guild_id: json.dumps(self.server_configs[guild_id]) for guild_id in self._dirty}
+        lock_rows, self._dirty_locks = self._dirty_locks, {}
+        cooldown_rows, self._dirty_cooldowns = self._dirty_cooldowns, {}
+        stats_rows, self._dirty_stats = self._dirty_stats, {}
+        self._dirty.clear()
+        try:
+            await asyncio.get_running_loop().run_in_executor(self._executor, self._write, rows, lock_rows, cooldown_rows, stats_rows)
+        except Exception as e:
+            # Keep them dirty so the next flush tries again, without undoing anything newer
+            self._dirty.update(rows)
+            self._dirty_locks = {**lock_rows, **self._dirty_locks}
+            self._dirty_cooldowns = {**cooldown_rows, **self._dirty_cooldowns}
+            self._dirty_stats = {**stats_rows, **self._dirty_stats}
+            log.warning("Failed to save server settings: %s", e)
+
+    async def close(self):
+        if self._flush_task is not None and not self._flush_task.done():
+            self._flush_task.cancel()
+        await self.flush()
+        await asyncio.get_running_loop().run_in_executor(self._executor, self._close_connection)
+        self._executor.shutdown(wait=False)
+
+    def _close_connection(self):
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
@@ -0,0 +1,49 @@
+import time
+from collections import OrderedDict
+
+class TTLTable:
+    """A dict of timestamps keyed by ID that forgets entries after ttl seconds and never holds more than max_entries.
+
+    Entries are kept in the order they were last set, which is also the order
+    they expire in, so dropping stale ones only ever looks at the front.
+    """
+
+    def __init__(self, ttl, max_entries=100_000, clock=time.time):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.clock = clock
+        self.entries = OrderedDict()  # key -> (timestamp, value)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def set(self, key, value, timestamp=None):
+        timestamp = self.clock() if timestamp is None else timestamp
+        self.entries[key] = (timestamp, value)
+        self.entries.move_to_end(key)
+        self.expire()
+
+    def get(self, key, default=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            return default
+        if self.clock() - entry[0] >= self.ttl:
+            del self.entries[key]
+            return default
+        return entry[1]
+
+    def pop(self, key, default=None):
+        entry = self.entries.pop(key, None)
+        return default if entry is None else entry[1]
+
+    def expire(self):
+        cutoff = self.clock() - self.ttl
+        entries = self.entries
+        while entries:
+            key, (timestamp, _) = next(iter(entries.items()))
+            if timestamp > cutoff and len(entries) <= self.max_entries:
+                break
+            del entries[key]
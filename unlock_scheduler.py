@@ -0,0 +1,100 @@
+import asyncio, heapq, itertools, logging, time
+
+log = logging.getLogger('turo.scheduler')
+
+class UnlockScheduler:
+    """One timer for every pending auto-unlock, instead of a sleeping task per lock.
+
+    Unlocks sit in a min-heap ordered by unlock time and keyed by channel ID.
+    Rescheduling or cancelling a channel is O(log n): the old heap entry is
+    just marked dead and skipped when it reaches the top. Everything that is
+    due at the same moment is handed to the callback as one batch.
+    """
+
+    def __init__(self, callback):
+        self.callback = callback  # async callback(channel_ids) for a batch of due channels
+        self._heap = []
+        self._entries = {}  # channel ID -> live heap entry [unlock_time, sequence, channel_id]
+        self._dead = 0
+        self._sequence = itertools.count()
+        self._wakeup = asyncio.Event()
+        self._runner = None
+        self._batches = set()
+
+    @property
+    def pending(self):
+        return len(self._entries)
+
+    def __contains__(self, channel_id):
+        return channel_id in self._entries
+
+    def unlock_time(self, channel_id):
+        entry = self._entries.get(channel_id)
+        return entry[0] if entry else None
+
+    def schedule(self, channel_id, unlock_time):
+        """Schedules (or reschedules) a channel to unlock at a time.time() timestamp."""
+        self.cancel(channel_id)
+        entry = [unlock_time, next(self._sequence), channel_id]
+        self._entries[channel_id] = entry
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry:
+            self._wakeup.set()
+
+    def cancel(self, channel_id):
+        entry = self._entries.pop(channel_id, None)
+        if entry is None:
+            return False
+        entry[2] = None
+        self._dead += 1
+        # Don't let a lot of cancelled locks pile up in the heap
+        if self._dead > 64 and self._dead > len(self._heap) // 2:
+            self._heap = [entry for entry in self._heap if entry[2] is not None]
+            heapq.heapify(self._heap)
+            self._dead = 0
+        return True
+
+    def start(self):
+        if self._runner is None or self._runner.done():
+            self._runner = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._runner is not None:
+            self._runner.cancel()
+            try:
+                await self._runner
+            except asyncio.CancelledError:
+                pass
+            self._runner = None
+
+    def _pop_due(self, now):
+        due = []
+        while self._heap and (self._heap[0][2] is None or self._heap[0][0] <= now):
+            _, _, channel_id = heapq.heappop(self._heap)
+            if channel_id is None:
+                self._dead -= 1
+                continue
+            del self._entries[channel_id]
+            due.append(channel_id)
+        return due
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            now = time.time()
+            due = self._pop_due(now)
+            if due:
+                batch = asyncio.get_running_loop().create_task(self._fire(due))
+                self._batches.add(batch)
+                batch.add_done_callback(self._batches.discard)
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _fire(self, channel_ids):
+        try:
+            await self.callback(channel_ids)
+        except Exception:
+            log.exception("Failed to auto-unlock %d channel(s)", len(channel_ids))